@@ -0,0 +1,97 @@
+"""Cost of the `bypass_paths` check of `AuthBackend`.
+
+Measures `AuthBackend.is_bypassed` for matching and non-matching paths, and the whole
+`Auth.get_current_user` call of a bypassed request (requests are built beforehand), in nanoseconds per call.
+Results are printed as JSON.
+
+Usage:
+    python benchmarks/bypass_paths.py --number 200000 --patterns 20
+"""
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+from typing import Callable, Sequence
+
+from sqlalchemy_database import AsyncDatabase
+from starlette.requests import Request
+
+from fastapi_user_auth import __version__
+from fastapi_user_auth.auth import Auth
+
+BYPASS_PATHS = ["/amis/static", "/docs", "/redoc", "/openapi.json", "/metrics", "/health*", "*.js", "*.css"]
+
+
+def make_patterns(count: int) -> list:
+    return BYPASS_PATHS + [f"/static/app{i}/*" for i in range(max(count - len(BYPASS_PATHS), 0))]
+
+
+def make_request(path: str) -> Request:
+    return Request({"type": "http", "method": "GET", "path": path, "headers": [], "client": ("127.0.0.1", 1)})
+
+
+def bench(func: Callable, number: int) -> float:
+    """Return the best per call time in nanoseconds of 5 runs."""
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - start)
+    return round(best / number * 1e9, 1)
+
+
+async def bench_async(func: Callable, number: int) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            await func()
+        best = min(best, time.perf_counter() - start)
+    return round(best / number * 1e9, 1)
+
+
+async def main(args: argparse.Namespace) -> dict:
+    auth = Auth(db=AsyncDatabase.create("sqlite+aiosqlite:///:memory:"), bypass_paths=make_patterns(args.patterns))
+    backend = auth.backend
+    results = []
+    for path in ["/amis/static/sdk.js", "/healthz", "/admin/page/app.css", "/admin/user/list"]:
+        ns = bench(lambda: backend.is_bypassed(path), args.number)  # noqa: B023
+        results.append({"case": "is_bypassed", "path": path, "bypassed": backend.is_bypassed(path), "ns": ns})
+
+    number = args.number // 10
+    requests = iter([make_request("/amis/static/sdk.js") for _ in range(number * 5)])  # 每次使用新的请求,避免命中scope中的结果
+
+    async def get_current_user():
+        return await auth.get_current_user(next(requests))
+
+    results.append(
+        {
+            "case": "get_current_user",
+            "path": "/amis/static/sdk.js",
+            "bypassed": True,
+            "ns": await bench_async(get_current_user, number),
+        }
+    )
+    return {
+        "meta": {
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "patterns": len(backend.bypass_paths),
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv: Sequence[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200000, help="calls per measurement")
+    parser.add_argument("--patterns", type=int, default=20, help="number of bypass patterns")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    sys.stdout.write(json.dumps(asyncio.run(main(parse_args())), indent=2) + "\n")
@@ -0,0 +1,112 @@
+"""Per-request overhead of `Auth.requires` on sync routes.
+
+Compares the previous implementation, which created a new event loop in the worker thread for every request,
+with the current one, which runs the authorization check on the application's loop through `anyio.from_thread`.
+Both are called from anyio worker threads, as Starlette does for sync routes, and the results are printed as JSON.
+
+Usage:
+    python benchmarks/requires_sync.py --requests 2000 --concurrency 1,10,40
+"""
+import argparse
+import asyncio
+import functools
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from typing import Callable, List, Sequence
+
+import anyio
+from sqlalchemy_database import AsyncDatabase
+from starlette.requests import Request
+
+from fastapi_user_auth import __version__
+from fastapi_user_auth.auth import Auth
+
+
+def legacy_requires(auth: Auth, func: Callable) -> Callable:
+    """The sync wrapper of `Auth.requires` before it used `anyio.from_thread`."""
+    depend = auth.requires(response=False)()
+
+    @functools.wraps(func)
+    def sync_wrapper(request: Request):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        response = loop.run_until_complete(loop.create_task(depend(request)))
+        if response is True:
+            return func(request)
+        return response
+
+    return sync_wrapper
+
+
+def endpoint(request: Request):
+    return "ok"
+
+
+def make_request() -> Request:
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": [], "client": ("127.0.0.1", 1)})
+
+
+def open_fds() -> int:
+    try:
+        return len(os.listdir("/proc/self/fd"))
+    except OSError:  # 非Linux系统
+        return -1
+
+
+async def run(wrapper: Callable, requests: int, concurrency: int) -> dict:
+    """Call `wrapper` `requests` times from `concurrency` worker threads, each calling it sequentially."""
+    latencies: List[float] = []
+    limiter = anyio.CapacityLimiter(concurrency)
+
+    async def worker(count: int):
+        for _ in range(count):
+            start = time.perf_counter()
+            await anyio.to_thread.run_sync(wrapper, make_request(), limiter=limiter)
+            latencies.append(time.perf_counter() - start)
+
+    gc.collect()  # 回收之前测试中泄露的事件循环
+    fds = open_fds()
+    start = time.perf_counter()
+    async with anyio.create_task_group() as tg:
+        for i in range(concurrency):
+            tg.start_soon(worker, requests // concurrency + (i < requests % concurrency))
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "requests": requests,
+        "seconds": round(seconds, 6),
+        "throughput": round(requests / seconds, 2),
+        "p50_us": round(latencies[len(latencies) // 2] * 1e6, 2),
+        "p99_us": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1e6, 2),
+        "leaked_fds": open_fds() - fds,  # 未关闭的事件循环占用的文件描述符
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    auth = Auth(db=AsyncDatabase.create("sqlite+aiosqlite:///:memory:"))  # 未登录请求不会访问数据库
+    wrappers = {"new_event_loop": legacy_requires(auth, endpoint), "from_thread": auth.requires(response=False)(endpoint)}
+    results = []
+    for concurrency in args.concurrency:
+        for name, wrapper in wrappers.items():
+            results.append({"implementation": name, "concurrency": concurrency, **await run(wrapper, args.requests, concurrency)})
+    return {
+        "meta": {"version": __version__, "python": platform.python_version(), "platform": platform.platform()},
+        "results": results,
+    }
+
+
+def parse_args(argv: Sequence[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", default="1,10,40", help="comma separated numbers of worker threads")
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    return args
+
+
+if __name__ == "__main__":
+    sys.stdout.write(json.dumps(asyncio.run(main(parse_args())), indent=2) + "\n")
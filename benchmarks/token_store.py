@@ -0,0 +1,189 @@
+"""Token store throughput benchmark.
+
+Measures `write_token`, `read_token` and `destroy_token` throughput and p50/p99 latency
+at several concurrency levels, and prints the results as JSON so they can be diffed between releases.
+
+Usage:
+    python benchmarks/token_store.py --operations 2000 --concurrency 1,10,100 --output result.json
+    python benchmarks/token_store.py --stores redis --redis-url redis://127.0.0.1:6379/0
+
+Redis is benchmarked against fakeredis unless `--redis-url` is given.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Sequence, Tuple
+
+import rsa
+from sqlalchemy_database import AsyncDatabase, Database
+from sqlmodel import SQLModel
+
+from fastapi_user_auth import __version__
+from fastapi_user_auth.auth.backends.base import BaseTokenStore
+from fastapi_user_auth.auth.backends.db import DbTokenStore, TokenStoreModel
+from fastapi_user_auth.auth.backends.jwt import JwtTokenStore
+from fastapi_user_auth.auth.backends.redis import RedisTokenStore
+from fastapi_user_auth.auth.schemas import BaseTokenData
+
+SECRET_KEY = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
+
+# 每个后端: 创建存储, 以及模拟一次请求的会话上下文
+StoreFactory = Callable[[argparse.Namespace, str], AsyncIterator[Tuple[BaseTokenStore, Callable]]]
+
+
+@asynccontextmanager
+async def no_session():
+    yield
+
+
+def db_store(url: str, database_cls):
+    @asynccontextmanager
+    async def factory(args: argparse.Namespace, workdir: str):
+        db = database_cls.create(url.format(workdir=workdir))
+        await db.async_run_sync(SQLModel.metadata.create_all, tables=[TokenStoreModel.__table__], is_session=False)
+        # WAL模式下读写互不阻塞, 并发写入时不会因锁升级而死锁
+        await db.async_run_sync(lambda conn: conn.exec_driver_sql("PRAGMA journal_mode=WAL"), is_session=False)
+        try:
+            yield DbTokenStore(db), db  # 每次操作使用独立的会话, 与请求中的行为一致
+        finally:
+            if isinstance(db, AsyncDatabase):
+                await db.async_close()
+            else:
+                db.close()
+
+    return factory
+
+
+def jwt_store(algorithm: str):
+    @asynccontextmanager
+    async def factory(args: argparse.Namespace, workdir: str):
+        if algorithm.startswith("HS"):
+            yield JwtTokenStore(secret_key=SECRET_KEY, algorithm=algorithm), no_session
+            return
+        _, private_key = rsa.newkeys(2048)
+        yield JwtTokenStore(secret_key=private_key.save_pkcs1().decode(), algorithm=algorithm), no_session
+
+    return factory
+
+
+@asynccontextmanager
+async def redis_store(args: argparse.Namespace, workdir: str):
+    if args.redis_url:
+        from redis.asyncio import Redis
+
+        redis = Redis.from_url(args.redis_url)
+    else:
+        from fakeredis import FakeAsyncRedis
+
+        redis = FakeAsyncRedis()
+    try:
+        yield RedisTokenStore(redis), no_session
+    finally:
+        await redis.aclose()
+
+
+STORES: Dict[str, StoreFactory] = {
+    "db-sqlite": db_store("sqlite:///{workdir}/sync.db?check_same_thread=False&timeout=60", Database),
+    "db-aiosqlite": db_store("sqlite+aiosqlite:///{workdir}/async.db?check_same_thread=False&timeout=60", AsyncDatabase),
+    "jwt-hs256": jwt_store("HS256"),
+    "jwt-rs256": jwt_store("RS256"),
+    "redis": redis_store,
+}
+
+
+def percentile(latencies: List[float], q: float) -> float:
+    index = min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))
+    return latencies[index]
+
+
+async def run_operation(items: Sequence, concurrency: int, operation: Callable, session: Callable) -> Tuple[list, dict]:
+    """Run `operation` once per item with `concurrency` workers, return the results and the statistics."""
+    results, latencies = [None] * len(items), []
+    indexes = iter(range(len(items)))
+
+    async def worker():
+        for index in indexes:
+            start = time.perf_counter()
+            async with session():
+                results[index] = await operation(items[index])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    return results, {
+        "ops": len(items),
+        "seconds": round(seconds, 6),
+        "throughput": round(len(items) / seconds, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 4),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 4),
+    }
+
+
+async def bench_store(name: str, args: argparse.Namespace, workdir: str) -> List[dict]:
+    results = []
+    async with STORES[name](args, workdir) as (store, session):
+        for concurrency in args.concurrency:
+            items = [BaseTokenData(id=i, username=f"user{i}") for i in range(args.operations)]
+            tokens, stats = await run_operation(items, concurrency, store.write_token, session)
+            results.append({"store": name, "operation": "write_token", "concurrency": concurrency, **stats})
+            data, stats = await run_operation(tokens, concurrency, store.read_token, session)
+            assert all(item is not None for item in data), f"{name}: tokens lost after write"
+            results.append({"store": name, "operation": "read_token", "concurrency": concurrency, **stats})
+            _, stats = await run_operation(tokens, concurrency, store.destroy_token, session)
+            results.append({"store": name, "operation": "destroy_token", "concurrency": concurrency, **stats})
+    return results
+
+
+async def main(args: argparse.Namespace) -> dict:
+    # 同步数据库的操作在线程池中执行, 线程数不足时等待锁的线程会阻塞持有锁的会话提交
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max(args.concurrency) + 4))
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in args.stores:
+            results.extend(await bench_store(name, args, workdir))
+    return {
+        "meta": {
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "operations": args.operations,
+            "redis": args.redis_url or "fakeredis",
+            "timestamp": int(time.time()),
+        },
+        "results": results,
+    }
+
+
+def parse_args(argv: Sequence[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--stores", default=",".join(STORES), help="comma separated stores to benchmark")
+    parser.add_argument("--operations", type=int, default=1000, help="operations per store, operation and concurrency")
+    parser.add_argument("--concurrency", default="1,10,100", help="comma separated concurrency levels")
+    parser.add_argument("--redis-url", default=os.environ.get("BENCHMARK_REDIS_URL"), help="benchmark a real redis server")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    args = parser.parse_args(argv)
+    args.stores = [name.strip() for name in args.stores.split(",") if name.strip()]
+    unknown = set(args.stores) - set(STORES)
+    if unknown:
+        parser.error(f"unknown stores: {', '.join(sorted(unknown))}")
+    args.concurrency = [int(level) for level in args.concurrency.split(",")]
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    report = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        sys.stdout.write(report + "\n")
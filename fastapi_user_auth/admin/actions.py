@@ -25,6 +25,7 @@ from fastapi_user_auth.utils.casbin import (
     get_subject_effect_matrix,
     get_subject_page_permissions,
     get_subject_policy_matrix,
+    load_subjects,
     permission_decode,
     update_subject_data_permissions,
     update_subject_page_permissions,
@@ -322,6 +323,7 @@ class UpdateSubDataPermAction(BaseSubPermAction):
             # 获取对方权限列表
             subject = await self.get_subject_by_id(item_id)
             options = []
+            await load_subjects(self.site.auth.enforcer, subject)
             options = get_admin_action_options_by_subject(self.site.auth.enforcer, subject, self.site)
             return BaseApiOut(data=options)
 
@@ -370,6 +372,7 @@ class UpdateSubDataPermAction(BaseSubPermAction):
                 return out
             # 设置初始值
             subject = await self.get_subject_by_id(item_id)
+            await load_subjects(self.site.auth.enforcer, subject)
             if type == "effect":
                 value = get_subject_effect_matrix(self.site.auth.enforcer, subject=subject, rows=rows)
             else:
@@ -428,6 +431,7 @@ class UpdateSubPagePermsAction(ViewSubPagePermAction):
         permissions = [perm for perm in data.permissions.split(",") if perm and perm.endswith("#page")]  # 分割权限列表,去除空值
         enforcer: AsyncEnforcer = self.site.auth.enforcer
         if permissions and identity != SystemUserEnum.ROOT:
+            await load_subjects(enforcer, "u:" + identity)
             #  检查当前用户是否有对应的权限,只有自己拥有的权限才能分配给其他主体
             permissions = [perm for perm in permissions if enforcer.enforce("u:" + identity, *permission_decode(perm))]
         await update_subject_page_permissions(enforcer, subject=subject, permissions=permissions)  # 更新角色权限
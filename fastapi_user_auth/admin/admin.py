@@ -30,6 +30,7 @@ from fastapi_amis_admin.crud.schema import BaseApiOut
 from fastapi_amis_admin.utils.pydantic import model_fields
 from fastapi_amis_admin.utils.translation import i18n as _
 from pydantic import BaseModel
+from sqlalchemy import inspect as sa_inspect
 from sqlalchemy import select
 from sqlmodel.sql.expression import Select
 from starlette import status
@@ -59,6 +60,7 @@ from fastapi_user_auth.auth.models import (
 )
 from fastapi_user_auth.auth.schemas import SystemUserEnum, UserLoginOut
 from fastapi_user_auth.mixins.admin import AuthFieldModelAdmin, AuthSelectModelAdmin
+from fastapi_user_auth.utils.enforcer import AsyncCachedEnforcer
 
 
 def attach_page_head(page: Page) -> Page:
@@ -125,7 +127,7 @@ class UserLoginFormAdmin(FormAdmin):
     @property
     def route_page(self) -> Callable:
         async def route(request: Request, result=Depends(super().route_page)):
-            if request.user:
+            if await request.auth.get_current_user(request):
                 raise HTTPException(
                     status_code=status.HTTP_307_TEMPORARY_REDIRECT,
                     detail="already logged in",
@@ -161,7 +163,7 @@ class UserRegFormAdmin(FormAdmin):
         if user:
             return BaseApiOut(status=-2, msg=_("Email has been registered!"), data=None)
         values = data.dict(exclude={"id", "password"})
-        values["password"] = auth.pwd_context.hash(data.password.get_secret_value())  # 密码hash保存
+        values["password"] = await auth.hash_password(data.password)  # 密码hash保存
         user = self.user_model.parse_obj(values)
         try:
             auth.db.add(user)
@@ -233,7 +235,8 @@ class UserInfoFormAdmin(FormAdmin):
     page_route_kwargs = {"name": "userinfo"}
 
     async def get_init_data(self, request: Request, **kwargs) -> BaseApiOut[Any]:
-        return BaseApiOut(data=request.user.dict(exclude={"password"}))
+        user = await request.auth.get_user(request.user.id)
+        return BaseApiOut(data=user.dict(exclude={"password"}))
 
     async def get_form(self, request: Request) -> Form:
         form = await super().get_form(request)
@@ -246,13 +249,19 @@ class UserInfoFormAdmin(FormAdmin):
         return form
 
     async def handle(self, request: Request, data: SchemaUpdateT, **kwargs) -> BaseApiOut[Any]:
+        user = await request.auth.get_user(request.user.id)  # request.user可能是token中的用户快照
         for k, v in data.dict(exclude_none=True).items():
             if k == "password":
                 if not v:
                     continue
-                v = request.auth.get_password_hash(v)
-            setattr(request.user, k, v)
-        return BaseApiOut(data=request.user.dict(exclude={"password"}))
+                v = await request.auth.hash_password(v)
+            setattr(user, k, v)
+        if sa_inspect(user).detached:  # 从用户缓存中获取的用户
+            request.auth.db.add(user)
+        result = user.dict(exclude={"password"})
+        await request.auth.db.async_commit()  # 提交后再清除缓存
+        await request.auth.invalidate_user(result["id"])
+        return BaseApiOut(data=result)
 
     async def has_page_permission(self, request: Request, obj: PageSchemaAdmin = None, action: str = None) -> bool:
         return await self.site.auth.requires(response=False)(request)
@@ -311,15 +320,32 @@ class UserAdmin(AuthFieldModelAdmin, AuthSelectModelAdmin, SoftDeleteModelAdmin,
 
     async def on_create_pre(self, request: Request, obj, **kwargs) -> Dict[str, Any]:
         data = await super(UserAdmin, self).on_create_pre(request, obj, **kwargs)
-        data["password"] = request.auth.get_password_hash(data["password"])
+        data["password"] = await request.auth.hash_password(data["password"])
         return data
 
     async def on_update_pre(self, request: Request, obj, item_id: List[int], **kwargs) -> Dict[str, Any]:
         data = await super(UserAdmin, self).on_update_pre(request, obj, item_id, **kwargs)
         if data.get("password", None):
-            data["password"] = request.auth.get_password_hash(data["password"])
+            data["password"] = await request.auth.hash_password(data["password"])
         return data
 
+    async def update_items(self, request: Request, item_id: List[str], values: Dict[str, Any]) -> List[BaseUser]:
+        items = await super(UserAdmin, self).update_items(request, item_id, values)
+        user_ids = [item.id for item in items]  # 使用主键的实际类型,item_id为字符串
+        await self.db.async_commit()  # 提交后再清除缓存,避免其他请求在提交前重新缓存旧数据
+        await request.auth.invalidate_user(*user_ids)
+        if values.get("password", None) or values.get("is_active", True) is False:  # 修改密码或禁用用户后,注销用户的全部token
+            await request.auth.destroy_user_tokens(*user_ids)
+        return items
+
+    async def delete_items(self, request: Request, item_id: List[str]) -> List[BaseUser]:
+        items = await super(UserAdmin, self).delete_items(request, item_id)
+        user_ids = [item.id for item in items]
+        await self.db.async_commit()
+        await request.auth.invalidate_user(*user_ids)
+        await request.auth.destroy_user_tokens(*user_ids)
+        return items
+
 
 class RoleAdmin(AutoTimeModelAdmin, FootableModelAdmin):
     unique_id = "Auth>RoleAdmin"
@@ -390,15 +416,20 @@ class CasbinRuleAdmin(ReadOnlyModelAdmin):
         async def _load_policy():
             await self.load_policy()
 
-    async def load_policy(self):
-        await self.site.auth.enforcer.load_policy()
+    async def load_policy(self, full: bool = True):
+        """Reload the policies, with `full=False` only the changes since the last load are applied when possible."""
+        enforcer = self.site.auth.enforcer
+        if full or not isinstance(enforcer, AsyncCachedEnforcer):
+            await enforcer.load_policy()
+        else:
+            await enforcer.load_policy_changes()
         # 更新站点资源分组
-        await update_casbin_site_grouping(self.site.auth.enforcer, self.site)
+        await update_casbin_site_grouping(enforcer, self.site)
 
     def register_router(self):
         @self.router.get("/load_policy", response_model=BaseApiOut)
-        async def _load_policy():
-            await self.load_policy()
+        async def _load_policy(full: bool = False):
+            await self.load_policy(full=full)
             get_admin_action_options.cache_clear()  # 清除系统菜单缓存
             return BaseApiOut(data=_("Refresh successful"))  # 刷新成功
 
@@ -17,6 +17,7 @@ from fastapi_user_auth.admin import UserRegFormAdmin as DefaultUserRegFormAdmin
 from fastapi_user_auth.admin.utils import get_admin_action_options_by_subject
 from fastapi_user_auth.auth import AuthRouter
 from fastapi_user_auth.auth.schemas import SystemUserEnum
+from fastapi_user_auth.utils.casbin import load_subjects
 
 
 class UserAuthApp(AdminApp, AuthRouter):
@@ -71,6 +72,7 @@ class UserAuthApp(AdminApp, AuthRouter):
             # 获取当前登录用户的权限
             username = await self.auth.get_current_user_identity(request) or SystemUserEnum.GUEST
             # 获取当前用户的权限列表
+            await load_subjects(self.auth.enforcer, "u:" + username)
             options = get_admin_action_options_by_subject(enforcer=self.auth.enforcer, subject="u:" + username, group=self.site)
             return BaseApiOut(data=options)
 
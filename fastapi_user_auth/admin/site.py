@@ -19,6 +19,7 @@ from starlette.requests import Request
 from fastapi_user_auth.admin import UserAuthApp as DefaultUserAuthApp
 from fastapi_user_auth.auth import Auth
 from fastapi_user_auth.auth.schemas import SystemUserEnum
+from fastapi_user_auth.utils.casbin import load_subjects
 
 
 class AuthAdminSite(AdminSite):
@@ -30,6 +31,12 @@ class AuthAdminSite(AdminSite):
         super().__init__(settings, fastapi=fastapi, engine=engine)
         self.auth = auth or self.auth or Auth(db=self.db)
         self.register_admin(self.UserAuthApp)
+        self.router.add_event_handler("shutdown", self.auth.close)
+
+    def mount_app(self, fastapi: FastAPI, **kwargs) -> None:
+        super().mount_app(fastapi, **kwargs)
+        # 挂载的子应用不会收到lifespan事件,在主应用关闭时释放auth的后台资源
+        fastapi.add_event_handler("shutdown", self.auth.close)
 
     def get_page_schema(self) -> Optional[PageSchema]:
         if super().get_page_schema():
@@ -81,5 +88,6 @@ class AuthAdminSite(AdminSite):
         subject = await self.auth.get_current_user_identity(request) or SystemUserEnum.GUEST
         if action != "page":
             action = "page:" + action
+        await load_subjects(self.auth.enforcer, "u:" + subject)
         effect = self.auth.enforcer.enforce("u:" + subject, obj.unique_id, action, "page")
         return effect
@@ -1,21 +1,27 @@
 import asyncio
 import contextlib
+import fnmatch
 import functools
 import inspect
+import re
+import warnings
 from collections.abc import Coroutine
 from pathlib import Path
 from typing import (
     Any,
     Callable,
+    Dict,
     Generic,
     Optional,
     Sequence,
+    Set,
     Tuple,
     Type,
     TypeVar,
     Union,
 )
 
+import anyio
 from casbin import AsyncEnforcer
 from fastapi import Depends, FastAPI, Form, HTTPException, params
 from fastapi.security import OAuth2PasswordBearer
@@ -28,7 +34,9 @@ from fastapi_amis_admin.utils.pydantic import create_model_by_model
 from fastapi_amis_admin.utils.translation import i18n as _
 from passlib.context import CryptContext
 from pydantic import BaseModel, SecretStr
-from sqlalchemy.orm import Session
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy_database import AsyncDatabase, Database
 from sqlmodel import select
 from starlette.authentication import AuthenticationBackend
@@ -37,19 +45,41 @@ from starlette.requests import Request
 from starlette.responses import RedirectResponse, Response
 from starlette.websockets import WebSocket
 
+from ..utils.cache import TTLCache
+from ..utils.enforcer import AsyncCachedEnforcer
 from ..utils.sqlachemy_adapter import Adapter
 from .backends.base import BaseTokenStore
 from .backends.db import DbTokenStore
-from .models import BaseUser, CasbinRule, LoginHistory, Role, User
-from .schemas import BaseTokenData, UserLoginOut
+from .hasher import PasswordHasher, calibrate_crypt_context
+from .history import LoginHistoryWriter
+from .middleware import USER_PENDING, LazyAuthenticationMiddleware
+from .models import BaseUser, CasbinRule, CasbinRuleChange, LoginHistory, Role, User
+from .schemas import BaseTokenData, SystemUserEnum, UserLoginOut, UserSnapshotTokenData
+from .throttle import LoginThrottle
 
 UserModelT = TypeVar("UserModelT", bound=BaseUser)
 
 
 class AuthBackend(AuthenticationBackend, Generic[UserModelT]):
-    def __init__(self, auth: "Auth", token_store: BaseTokenStore):
+    def __init__(self, auth: "Auth", token_store: BaseTokenStore, bypass_paths: Sequence[str] = None):
         self.auth = auth
         self.token_store = token_store
+        self.bypass_paths = list(bypass_paths or [])
+        self._bypass = self.compile_paths(self.bypass_paths)
+
+    @staticmethod
+    def compile_paths(paths: Sequence[str]) -> Optional[Callable[[str], Any]]:
+        """Compile path prefixes and glob patterns (containing `*`, `?` or `[`) into one regex match function.
+        Prefixes match whole path segments: `/docs` matches `/docs` and `/docs/x`, not `/docsecret`."""
+        patterns = [
+            fnmatch.translate(path) if any(c in path for c in "*?[") else re.escape(path) + ("" if path.endswith("/") else "(?:/|$)")
+            for path in paths
+        ]
+        return re.compile("|".join(patterns)).match if patterns else None
+
+    def is_bypassed(self, path: str) -> bool:
+        """Whether requests to `path` skip authentication, the user of such requests is always anonymous."""
+        return self._bypass is not None and self._bypass(path) is not None
 
     @staticmethod
     def get_user_token(request: Request) -> Optional[str]:
@@ -60,8 +90,13 @@ class AuthBackend(AuthenticationBackend, Generic[UserModelT]):
     async def authenticate(self, request: Request) -> Tuple["Auth", Optional[UserModelT]]:
         return self.auth, await self.auth.get_current_user(request)
 
-    def attach_middleware(self, app: FastAPI):
-        app.add_middleware(AuthenticationMiddleware, backend=self)  # 添加auth中间件
+    def attach_middleware(self, app: FastAPI, *, lazy: bool = False):
+        """Add the auth middleware, starlette's `AuthenticationMiddleware` which loads the user for every request.
+        With `lazy=True`, `request.user` stays `None` until `get_current_user` is awaited, see `LazyAuthenticationMiddleware`."""
+        if lazy:
+            app.add_middleware(LazyAuthenticationMiddleware, auth=self.auth)
+        else:
+            app.add_middleware(AuthenticationMiddleware, backend=self)  # 添加auth中间件
 
 
 class Auth(Generic[UserModelT]):
@@ -77,24 +112,51 @@ class Auth(Generic[UserModelT]):
         user_model: Type[UserModelT] = User,
         pwd_context: CryptContext = CryptContext(schemes=["bcrypt"], deprecated="auto"),
         enforcer: AsyncEnforcer = None,
+        user_cache_ttl: Optional[float] = None,
+        user_cache_maxsize: int = 10000,
+        user_snapshot: bool = False,
+        password_hasher: PasswordHasher = None,
+        login_history_writer: LoginHistoryWriter = None,
+        login_throttle: LoginThrottle = None,
+        bypass_paths: Sequence[str] = None,
     ):
         self.user_model = user_model or self.user_model
         assert self.user_model, "user_model is None"
         self.db = db or self.db
-        self.backend = self.backend or AuthBackend(self, token_store or DbTokenStore(self.db))
+        self.backend = self.backend or AuthBackend(self, token_store or DbTokenStore(self.db), bypass_paths)
         self.pwd_context = pwd_context
+        self.password_hasher = password_hasher or PasswordHasher(pwd_context)
+        self.login_history_writer = login_history_writer
+        self.login_throttle = login_throttle
         self._enforcer = enforcer
+        # 用户缓存,默认关闭.多进程部署时,其他进程中的修改最多在user_cache_ttl秒后生效
+        self.user_cache = TTLCache(maxsize=user_cache_maxsize, ttl=user_cache_ttl) if user_cache_ttl else None
+        # 在token中保存用户快照,请求时无需查询数据库.用户修改后token存储中的版本号递增,旧版本的快照将重新查询数据库
+        self.user_snapshot = user_snapshot
+        if user_snapshot:
+            token_store = self.backend.token_store
+            assert issubclass(
+                token_store.TokenDataSchema, UserSnapshotTokenData
+            ), "user_snapshot requires a token store with TokenDataSchema=UserSnapshotTokenData"
+            if getattr(token_store, "revocation_store", False) is None:  # JwtTokenStore
+                warnings.warn(
+                    "user_snapshot with a JwtTokenStore revokes the user's tokens on modification, "
+                    "set a revocation_store so that other processes see the revocation",
+                    stacklevel=2,
+                )
 
     @cached_property
     def enforcer(self) -> AsyncEnforcer:
         if self._enforcer is not None:
             return self._enforcer
-        enforcer = AsyncEnforcer(
+        enforcer = AsyncCachedEnforcer(
             model=str(Path(__file__).parent / "model.conf"),
             adapter=Adapter(
                 db=self.db,
                 db_class=CasbinRule,
+                change_class=CasbinRuleChange,
             ),
+            index_policies=True,
         )
         return enforcer
 
@@ -109,7 +171,10 @@ class Auth(Generic[UserModelT]):
         if user:
             pwd = password.get_secret_value() if isinstance(password, SecretStr) else password
             pwd2 = user.password.get_secret_value() if isinstance(user.password, SecretStr) else user.password
-            if self.pwd_context.verify(pwd, pwd2):  # 用户存在 且 密码验证通过
+            verified, new_hash = await self.password_hasher.verify_and_update(pwd, pwd2)
+            if verified:  # 用户存在 且 密码验证通过
+                if new_hash:  # 哈希算法或成本已更新,在当前事务中保存新的哈希
+                    user.password = new_hash
                 return user
         return None
 
@@ -117,6 +182,9 @@ class Auth(Generic[UserModelT]):
         if "user_token_info" in request.scope:  # 防止重复授权
             return request.scope["user_token_info"]
         request.scope["auth"] = self  # 为了在token_store中使用
+        if self.backend.is_bypassed(request.scope.get("path", "")):  # 无需认证的路径,不读取token
+            request.scope["user_token_info"] = None
+            return None
         token = self.backend.get_user_token(request)
         request.scope["user_token_info"] = await self.backend.token_store.read_token(token) if token else None
         return request.scope["user_token_info"]
@@ -127,34 +195,101 @@ class Auth(Generic[UserModelT]):
         user_identity = getattr(token_info, name, "") if token_info else ""
         return user_identity
 
-    async def has_role_for_user(self, identity: str, roles: Union[str, Sequence[str]], is_any: bool = True) -> bool:
-        identity = "u:" + identity
-        if isinstance(roles, str):
-            roles = [roles]
-        if identity == "u:root" and "root" in roles:  # 默认root用户拥有root角色
-            return True
-        for role in roles:
-            if not role:
-                continue
-            ret = await self.enforcer.has_role_for_user(identity, "r:" + role)
-            if is_any and ret:
-                return True
-            elif not is_any and not ret:
-                return False
-        return not is_any
+    async def get_roles_for_user(self, identity: str) -> Set[str]:
+        """Return the role keys of a user, including the roles inherited through other roles."""
+        roles = {role[2:] for role in await self.enforcer.get_implicit_roles_for_user("u:" + identity) if role.startswith("r:")}
+        if identity == SystemUserEnum.ROOT:  # 默认root用户拥有root角色
+            roles.add(SystemUserEnum.ROOT.value)
+        return roles
+
+    async def get_current_user_roles(self, request: Request) -> Set[str]:
+        """Return the role keys of the current user, resolved once per request."""
+        if "user_roles" not in request.scope:
+            identity = await self.get_current_user_identity(request)
+            request.scope["user_roles"] = await self.get_roles_for_user(identity) if identity else set()
+        return request.scope["user_roles"]
+
+    async def has_role_for_user(
+        self,
+        identity: str,
+        roles: Union[str, Sequence[str]],
+        is_any: bool = True,
+        *,
+        user_roles: Set[str] = None,
+    ) -> bool:
+        """Check the roles of a user, including inherited roles.
+        Pass `user_roles` to reuse roles that were already resolved."""
+        roles = {roles} if isinstance(roles, str) else {role for role in roles if role}
+        if not roles:
+            return not is_any
+        if user_roles is None:
+            user_roles = await self.get_roles_for_user(identity)
+        return bool(roles & user_roles) if is_any else roles <= user_roles
 
     async def has_role(self, request: Request, *, roles: Union[str, Sequence[str]]) -> bool:
         """判断当前用户是否拥有指定角色,拥有任意一个角色即返回True"""
         identity = await self.get_current_user_identity(request)
-        return await self.has_role_for_user(identity, roles, is_any=True)
+        return await self.has_role_for_user(identity, roles, is_any=True, user_roles=await self.get_current_user_roles(request))
 
     async def get_current_user(self, request: Request) -> Optional[UserModelT]:
-        if "user" in request.scope:  # 防止重复授权
-            return request.scope["user"]
+        scope = request.scope
+        if "user" in scope and not scope.get(USER_PENDING):  # 防止重复授权
+            return scope["user"]
+        if self.backend.is_bypassed(scope.get("path", "")):  # 无需认证的路径,直接返回匿名用户
+            scope["auth"] = self
+            scope["user_token_info"] = scope["user"] = None
+            scope.pop(USER_PENDING, None)
+            return None
         token_info = await self._get_token_info(request)
-        request.scope["user"]: UserModelT = await self.db.async_get(self.user_model, token_info.id) if token_info else None
+        if token_info is None:
+            user = None
+        elif self.user_snapshot and token_info.auth_version >= await self._get_user_version(token_info.id):
+            user = self._build_user(token_info.dict(exclude={"auth_version"}))
+        else:
+            user = await self.get_user(token_info.id)
+        request.scope["user"]: UserModelT = user
+        request.scope.pop(USER_PENDING, None)
         return request.scope["user"]
 
+    async def get_user(self, user_id: Any) -> Optional[UserModelT]:
+        """Get a user by id. With the user cache enabled, cached users are returned as detached instances."""
+        if self.user_cache is None:
+            return await self.db.async_get(self.user_model, user_id)
+        snapshot = self.user_cache.get(user_id)
+        if snapshot is None:
+            user = await self.db.async_get(self.user_model, user_id)
+            if user is not None:  # 缓存字段快照,而不是实例本身,避免请求之间共享可变对象
+                columns = sa_inspect(self.user_model).column_attrs
+                self.user_cache.set(user_id, {attr.key: getattr(user, attr.key) for attr in columns})
+            return user
+        return self._build_user(snapshot)
+
+    def _build_user(self, values: Dict[str, Any]) -> UserModelT:
+        """Build a detached user from column values, columns missing from `values` are None."""
+        mapper = sa_inspect(self.user_model)
+        user = mapper.class_manager.new_instance()
+        for attr in mapper.column_attrs:
+            set_committed_value(user, attr.key, values.get(attr.key))
+        make_transient_to_detached(user)  # 通过session.add()重新关联后,修改可以正常保存
+        return user
+
+    async def _get_user_version(self, user_id: Any) -> int:
+        try:
+            return await self.backend.token_store.get_user_version(user_id)
+        except NotImplementedError:  # 无状态的token存储通过注销token使快照失效
+            return 0
+
+    async def invalidate_user(self, *user_ids: Any) -> None:
+        """Drop the cached copies of users, call it whenever a user is modified."""
+        for user_id in user_ids:
+            if self.user_cache is not None:
+                self.user_cache.pop(user_id)
+            if self.user_snapshot:
+                try:
+                    await self.backend.token_store.incr_user_version(user_id)
+                except NotImplementedError:
+                    await self.destroy_user_tokens(user_id)
+
     def requires(
         self,
         roles: Union[str, Sequence[str]] = None,
@@ -165,12 +300,12 @@ class Auth(Generic[UserModelT]):
         # todo 优化
         roles_ = (roles,) if not roles or isinstance(roles, str) else tuple(roles)
 
-        async def has_requires(user: UserModelT) -> bool:
+        async def has_requires(request: Union[Request, WebSocket], user: UserModelT) -> bool:
             if not user:
                 return False
             if roles_ == (None,):
                 return True
-            return await self.has_role_for_user(user.username, roles_)
+            return await self.has_role_for_user(user.username, roles_, user_roles=await self.get_current_user_roles(request))
 
         async def depend(
             request: Request,
@@ -183,7 +318,7 @@ class Auth(Generic[UserModelT]):
             if cache_key not in request.scope["__user_auth__"]:  # 防止重复授权
                 if isinstance(user, params.Depends):
                     user = await self.get_current_user(request)
-                result = await has_requires(user)
+                result = await has_requires(request, user)
                 request.scope["__user_auth__"][cache_key] = result
             if not request.scope["__user_auth__"][cache_key]:
                 if response is not None:
@@ -215,7 +350,7 @@ class Auth(Generic[UserModelT]):
                     websocket = kwargs.get("websocket", args[idx] if args else None)
                     assert isinstance(websocket, WebSocket)
                     user = await self.get_current_user(websocket)  # type: ignore
-                    if not await has_requires(user):
+                    if not await has_requires(websocket, user):
                         await websocket.close()
                     else:
                         await func(*args, **kwargs)
@@ -241,9 +376,8 @@ class Auth(Generic[UserModelT]):
                 def sync_wrapper(*args: Any, **kwargs: Any) -> Response:
                     request = kwargs.get("request", args[idx] if args else None)
                     assert isinstance(request, Request)
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    response = loop.run_until_complete(loop.create_task(depend(request)))
+                    # 同步路由在线程池中执行,授权检查回到应用的事件循环中执行
+                    response = anyio.from_thread.run(depend, request)
                     if response is True:
                         return func(*args, **kwargs)
                     return response
@@ -290,40 +424,92 @@ class Auth(Generic[UserModelT]):
         return user
 
     async def request_login(self, request: Request, response: Response, username: str, password: str) -> BaseApiOut[UserLoginOut]:
-        if request.scope.get("user"):
+        if "user" in request.scope and await self.get_current_user(request):
             return BaseApiOut(code=1, msg=_("User logged in!"), data=UserLoginOut.parse_obj(request.user))
-        user = await request.auth.authenticate_user(username=username, password=password)
         # 保存登录记录
-        ip = request.client.host  # 获取真实ip
-        # 获取代理ip
-        ips = [request.headers.get(key, "").strip() for key in ["x-forwarded-for", "x-real-ip", "x-client-ip", "remote-host"]]
-        forwarded_for = ",".join([i for i in set(ips) if i and i != ip])
+        ip, forwarded_for = self.get_request_ip(request)
         history = LoginHistory(
-            user_id=user.id if user else None,
             login_name=username,
-            ip=request.client.host,
+            ip=ip,
             user_agent=request.headers.get("user-agent"),
             login_status=_("Login successful"),  # 登录成功
             forwarded_for=forwarded_for,
         )
-        self.db.add(history)
+        # 只信任代理追加的X-Forwarded-For,其他代理请求头可以由客户端任意设置
+        xff = ",".join(request.headers.getlist("x-forwarded-for"))
+        if self.login_throttle is not None and not await self.login_throttle.allow(username, ip, xff):
+            history.login_status = _("Too many attempts")  # 尝试次数过多,未校验密码
+            await self.save_login_history(history)
+            return BaseApiOut(status=-3, msg=_("Too many login attempts, please try again later!"))
+        user = await request.auth.authenticate_user(username=username, password=password)
+        history.user_id = user.id if user else None
         if not user:
             history.login_status = _("Wrong password")  # 密码错误
+            await self.save_login_history(history)
             return BaseApiOut(status=-1, msg=_("Incorrect username or password!"))
         if not user.is_active:
             history.login_status = _("User is not activated")  # 用户未激活
+            await self.save_login_history(history)
             return BaseApiOut(status=-2, msg=_("Inactive user status!"))
+        await self.save_login_history(history)
+        if self.login_throttle is not None:
+            await self.login_throttle.reset(username)
         request.scope["user"] = user
         token_info = UserLoginOut.parse_obj(request.user)
-        token_info.access_token = await request.auth.backend.token_store.write_token(request.user.dict())
+        token_data = request.user.dict()
+        if self.user_snapshot:
+            token_data["auth_version"] = await self._get_user_version(user.id)
+        token_info.access_token = await request.auth.backend.token_store.write_token(token_data)
         response.set_cookie("Authorization", f"bearer {token_info.access_token}")
         return BaseApiOut(code=0, data=token_info)
 
+    @staticmethod
+    def get_request_ip(request: Request) -> Tuple[str, str]:
+        """Return the client ip of the connection and the other ips reported by proxy headers."""
+        ip = request.client.host if request.client else ""  # 获取真实ip
+        # 获取代理ip
+        ips = [request.headers.get(key, "").strip() for key in ["x-forwarded-for", "x-real-ip", "x-client-ip", "remote-host"]]
+        forwarded_for = ",".join([i for i in dict.fromkeys(ips) if i and i != ip])  # 保持请求头的顺序
+        return ip, forwarded_for
+
+    async def save_login_history(self, history: LoginHistory) -> None:
+        """Save a login record, in the request session or through `login_history_writer` if set."""
+        if self.login_history_writer is None:
+            self.db.add(history)
+        else:
+            await self.login_history_writer.write(history)
+
+    async def close(self) -> None:
+        """Release background resources, call it on application shutdown."""
+        if self.login_history_writer is not None:
+            await self.login_history_writer.close()
+        self.password_hasher.shutdown()
+
+    async def destroy_user_tokens(self, *user_ids: Any) -> None:
+        """Revoke every token issued to the given users, e.g. after a password reset or deactivation."""
+        for user_id in user_ids:
+            with contextlib.suppress(NotImplementedError):  # 自定义的token存储可能不支持
+                await self.backend.token_store.destroy_user_tokens(user_id)
+
     def get_password_hash(self, password: Union[str, SecretStr]) -> str:
         if isinstance(password, SecretStr):
             password = password.get_secret_value()
         return self.pwd_context.hash(password) if password else ""
 
+    async def calibrate_password_hash(self, target_seconds: float = 0.25, **kwargs) -> CryptContext:
+        """Tune the password hash cost to about `target_seconds` per hash on this machine, e.g. on startup.
+        See `calibrate_crypt_context` for the keyword arguments."""
+        func = functools.partial(calibrate_crypt_context, self.pwd_context, target_seconds, **kwargs)
+        self.pwd_context = await asyncio.get_running_loop().run_in_executor(None, func)
+        self.password_hasher.pwd_context = self.pwd_context
+        return self.pwd_context
+
+    async def hash_password(self, password: Union[str, SecretStr]) -> str:
+        """Same as `get_password_hash`, but hashes on `password_hasher` without blocking the event loop."""
+        if isinstance(password, SecretStr):
+            password = password.get_secret_value()
+        return await self.password_hasher.hash(password) if password else ""
+
 
 class AuthRouter(RouterMixin):
     auth: Auth = None
@@ -376,7 +562,7 @@ class AuthRouter(RouterMixin):
     def route_userinfo(self):
         @self.auth.requires()
         async def userinfo(request: Request):
-            return BaseApiOut(data=request.user)
+            return BaseApiOut(data=await self.auth.get_user(request.user.id))
 
         return userinfo
 
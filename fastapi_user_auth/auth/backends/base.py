@@ -1,5 +1,6 @@
-from typing import Generic, Optional, TypeVar, Union
+from typing import Any, Generic, List, Optional, Tuple, TypeVar, Union
 
+from fastapi_user_auth.auth.backends.codec import BaseTokenCodec, JsonTokenCodec
 from fastapi_user_auth.auth.schemas import BaseTokenData
 
 _TokenDataSchemaT = TypeVar("_TokenDataSchemaT", bound=BaseTokenData)
@@ -8,15 +9,62 @@ _TokenDataSchemaT = TypeVar("_TokenDataSchemaT", bound=BaseTokenData)
 class BaseTokenStore(Generic[_TokenDataSchemaT]):
     TokenDataSchema: _TokenDataSchemaT
 
-    def __init__(self, expire_seconds: Optional[int] = 60 * 60 * 24 * 3, TokenDataSchema: _TokenDataSchemaT = None) -> None:
+    def __init__(
+        self,
+        expire_seconds: Optional[int] = 60 * 60 * 24 * 3,
+        TokenDataSchema: _TokenDataSchemaT = None,
+        codec: BaseTokenCodec = None,
+    ) -> None:
         self.TokenDataSchema = TokenDataSchema or BaseTokenData
         self.expire_seconds = expire_seconds
+        self.codec = codec or JsonTokenCodec()
 
     async def read_token(self, token: Optional[str]) -> Optional[_TokenDataSchemaT]:
         raise NotImplementedError
 
+    async def read_token_with_ttl(self, token: Optional[str]) -> Tuple[Optional[_TokenDataSchemaT], Optional[float]]:
+        """Read a token together with its remaining lifetime in seconds, `None` when unknown or unlimited."""
+        return await self.read_token(token), None
+
     async def write_token(self, token_data: Union[_TokenDataSchemaT, dict]) -> str:
         raise NotImplementedError
 
+    async def save_token(self, token: str, token_data: Union[_TokenDataSchemaT, dict]) -> None:
+        """Store `token_data` under an existing token, e.g. to copy a token between the tiers of a `TieredTokenStore`."""
+        raise NotImplementedError
+
     async def destroy_token(self, token: str) -> None:
         raise NotImplementedError
+
+    async def list_user_tokens(self, user_id: Any) -> List[str]:
+        """Return the live tokens issued to a user."""
+        raise NotImplementedError
+
+    async def destroy_user_tokens(self, user_id: Any) -> None:
+        """Destroy every token issued to a user, e.g. after a password reset or deactivation."""
+        raise NotImplementedError
+
+    async def get_user_version(self, user_id: Any) -> int:
+        """Return the auth version of a user, shared by every process using the store."""
+        raise NotImplementedError
+
+    async def incr_user_version(self, user_id: Any) -> int:
+        """Bump the auth version of a user, user snapshots stored in older tokens are then ignored."""
+        raise NotImplementedError
+
+
+class BaseRevocationStore:
+    """Persistent list of revoked token ids (`jti`), shared between processes.
+
+    `load` returns the entries added since `cursor` as `(jti, exp)` pairs together with a new cursor,
+    so each process can catch up incrementally. Pass `None` to load every entry that has not expired yet.
+    """
+
+    async def add(self, jti: str, exp: int) -> None:
+        raise NotImplementedError
+
+    async def load(self, cursor: Any = None) -> Tuple[List[Tuple[str, int]], Any]:
+        raise NotImplementedError
+
+    async def delete_expired(self) -> None:
+        """Delete the expired entries, called periodically by `JwtTokenStore`."""
@@ -0,0 +1,77 @@
+from typing import Any, List, Optional, Union
+
+from ...utils.cache import MISSING, CacheInfo, TTLCache
+from ..backends.base import BaseTokenStore, _TokenDataSchemaT
+
+
+class CachingTokenStore(BaseTokenStore):
+    """In-process LRU/TTL cache in front of any token store.
+
+    A destroyed token may stay readable in other processes for at most `ttl` seconds,
+    so keep `ttl` short when several workers share the backing store.
+    Entries never outlive the token's remaining lifetime reported by the backing store.
+    """
+
+    def __init__(
+        self,
+        store: BaseTokenStore,
+        maxsize: int = 10000,
+        ttl: Optional[int] = 60,
+        negative_ttl: Optional[int] = 5,
+    ):
+        super().__init__(store.expire_seconds, store.TokenDataSchema)
+        self.store = store
+        if ttl is not None and self.expire_seconds:
+            ttl = min(ttl, self.expire_seconds)
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.negative_ttl = negative_ttl
+
+    async def read_token(self, token: Optional[str]) -> Optional[_TokenDataSchemaT]:
+        if not token:
+            return None
+        data = self.cache.get(token, MISSING)
+        if data is not MISSING:
+            return data
+        data, remaining = await self.store.read_token_with_ttl(token)
+        if data is not None:
+            ttl = self.cache.ttl
+            if remaining is not None:  # 不超过token的剩余有效期
+                ttl = remaining if ttl is None else min(ttl, remaining)
+            self.cache.set(token, data, ttl=ttl)
+        elif self.negative_ttl:  # 缓存不存在的token,防止重复查询
+            self.cache.set(token, None, ttl=self.negative_ttl)
+        return data
+
+    async def write_token(self, token_data: Union[_TokenDataSchemaT, dict]) -> str:
+        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
+        token = await self.store.write_token(obj)
+        self.cache.set(token, obj)
+        return token
+
+    async def save_token(self, token: str, token_data: Union[_TokenDataSchemaT, dict]) -> None:
+        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
+        await self.store.save_token(token, obj)
+        self.cache.set(token, obj)
+
+    async def destroy_token(self, token: str) -> None:
+        self.cache.pop(token)
+        await self.store.destroy_token(token)
+
+    async def list_user_tokens(self, user_id: Any) -> List[str]:
+        return await self.store.list_user_tokens(user_id)
+
+    async def destroy_user_tokens(self, user_id: Any) -> None:
+        for token, data in self.cache.items():
+            if data is not None and data.id == user_id:
+                self.cache.pop(token)
+        await self.store.destroy_user_tokens(user_id)
+
+    async def get_user_version(self, user_id: Any) -> int:
+        return await self.store.get_user_version(user_id)
+
+    async def incr_user_version(self, user_id: Any) -> int:
+        return await self.store.incr_user_version(user_id)
+
+    def cache_info(self) -> CacheInfo:
+        """Return hit/miss counters and the current size of the cache."""
+        return self.cache.info()
@@ -0,0 +1,77 @@
+from typing import Any, Dict, Type, TypeVar, Union
+
+from fastapi_amis_admin.utils.pydantic import PYDANTIC_V2
+from pydantic import BaseModel
+
+_ModelT = TypeVar("_ModelT", bound=BaseModel)
+
+
+class BaseTokenCodec:
+    """Serialize token payloads for token stores that persist them."""
+
+    def encode(self, obj: BaseModel) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def decode(self, data: Union[str, bytes], schema: Type[_ModelT]) -> _ModelT:
+        raise NotImplementedError
+
+
+class JsonTokenCodec(BaseTokenCodec):
+    """Default codec, JSON with full pydantic validation on decode."""
+
+    def encode(self, obj: BaseModel) -> str:
+        return obj.json()
+
+    def decode(self, data: Union[str, bytes], schema: Type[_ModelT]) -> _ModelT:
+        return schema.parse_raw(data)
+
+
+class _TrustedDecodeMixin:
+    trusted: bool = True
+
+    def build(self, payload: Dict[str, Any], schema: Type[_ModelT]) -> _ModelT:
+        if not self.trusted:
+            return schema.parse_obj(payload)
+        # 数据由token存储自身写入,跳过校验直接构建.注意:不会进行类型转换,例如datetime字段将保持为字符串.
+        return schema.model_construct(**payload) if PYDANTIC_V2 else schema.construct(**payload)
+
+
+class OrjsonTokenCodec(_TrustedDecodeMixin, BaseTokenCodec):
+    """JSON codec based on `orjson`, compatible with data written by `JsonTokenCodec`.
+
+    With `trusted=True`, decoding builds the schema without validation.
+    """
+
+    def __init__(self, trusted: bool = True):
+        import orjson
+
+        self._orjson = orjson
+        self.trusted = trusted
+
+    def encode(self, obj: BaseModel) -> str:
+        return self._orjson.dumps(obj.dict(), default=str).decode()
+
+    def decode(self, data: Union[str, bytes], schema: Type[_ModelT]) -> _ModelT:
+        return self.build(self._orjson.loads(data), schema)
+
+
+class MsgpackTokenCodec(_TrustedDecodeMixin, BaseTokenCodec):
+    """Compact binary codec based on `msgpack`, for stores that keep bytes such as redis.
+
+    Data written by `JsonTokenCodec` is still readable.
+    With `trusted=True`, decoding builds the schema without validation.
+    """
+
+    def __init__(self, trusted: bool = True):
+        import msgpack
+
+        self._msgpack = msgpack
+        self.trusted = trusted
+
+    def encode(self, obj: BaseModel) -> bytes:
+        return self._msgpack.packb(obj.dict(), datetime=False, default=str)
+
+    def decode(self, data: Union[str, bytes], schema: Type[_ModelT]) -> _ModelT:
+        if isinstance(data, str) or data[:1] == b"{":  # 兼容旧的json数据
+            return schema.parse_raw(data)
+        return self.build(self._msgpack.unpackb(data), schema)
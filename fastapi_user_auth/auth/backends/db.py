@@ -1,51 +1,258 @@
+import asyncio
+import contextlib
+import logging
 import secrets
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Any, List, Optional, Set, Tuple, Union
 
-from sqlalchemy import Column, String, delete
+from sqlalchemy import Column, String, and_, delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy_database import AsyncDatabase, Database
 from sqlmodel import Field, select
 
-from ..backends.base import BaseTokenStore, _TokenDataSchemaT
+from ..backends.base import BaseRevocationStore, BaseTokenStore, _TokenDataSchemaT
+from ..backends.codec import BaseTokenCodec
 from ..models import CreateTimeMixin, PkMixin
 
+logger = logging.getLogger(__name__)
+
 
 class TokenStoreModel(PkMixin, CreateTimeMixin, table=True):
     __tablename__ = "auth_token"
     token: str = Field(..., max_length=48, sa_column=Column(String(48), unique=True, index=True, nullable=False))
     data: str = Field(default="")
+    expire_time: Optional[datetime] = Field(None, index=True)
+    user_id: Optional[str] = Field(None, max_length=64, index=True)  # 字符串保存,支持非整数主键
+
+
+class TokenVersionModel(PkMixin, table=True):
+    __tablename__ = "auth_token_version"
+    user_id: str = Field(..., max_length=64, sa_column=Column(String(64), unique=True, index=True, nullable=False))
+    version: int = Field(default=0)
+
+
+class TokenRevokedModel(PkMixin, CreateTimeMixin, table=True):
+    __tablename__ = "auth_token_revoked"
+    # token的jti,或者用户注销记录`user:{not_before}:{user_id}`
+    jti: str = Field(..., max_length=255, sa_column=Column(String(255), unique=True, index=True, nullable=False))
+    exp: int = Field(..., index=True)  # token过期时间戳
 
 
 class DbTokenStore(BaseTokenStore):
+    """Token store backed by the `auth_token` table.
+
+    With `batch_write=True`, concurrent `write_token` calls are coalesced into one multi-row INSERT,
+    flushed once `batch_max_size` tokens are pending or after `batch_max_latency` seconds.
+    Batched tokens are committed in their own session, independently of the request session.
+    """
+
     def __init__(
         self,
         db: Union[AsyncDatabase, Database],
         expire_seconds: Optional[int] = 60 * 60 * 24 * 3,
         TokenDataSchema: _TokenDataSchemaT = None,
+        *,
+        codec: BaseTokenCodec = None,
+        batch_write: bool = False,
+        batch_max_size: int = 100,
+        batch_max_latency: float = 0.005,
     ):
-        super().__init__(expire_seconds, TokenDataSchema)
+        super().__init__(expire_seconds, TokenDataSchema, codec)
         self.db = db
+        self.batch_write = batch_write
+        self.batch_max_size = batch_max_size
+        self.batch_max_latency = batch_max_latency
+        self._batch: List[Tuple[dict, asyncio.Future]] = []
+        self._batch_timer: Optional[asyncio.TimerHandle] = None
+        self._batch_tasks: Set[asyncio.Task] = set()
+        self._reaper: Optional[asyncio.Task] = None
+
+    def _expired_clause(self, now: datetime):
+        """Rows written before `expire_time` existed are expired by `create_time`."""
+        clause = TokenStoreModel.expire_time < now
+        if self.expire_seconds is not None:
+            legacy = and_(
+                TokenStoreModel.expire_time == None,  # noqa E711
+                TokenStoreModel.create_time < now - timedelta(seconds=self.expire_seconds),
+            )
+            clause = or_(clause, legacy)
+        return clause
+
+    def _alive_clause(self, now: datetime):
+        return or_(TokenStoreModel.expire_time == None, TokenStoreModel.expire_time > now)  # noqa E711
 
     async def read_token(self, token: str) -> Optional[_TokenDataSchemaT]:
-        stmt = select(TokenStoreModel).where(TokenStoreModel.token == token)
+        return (await self.read_token_with_ttl(token))[0]
+
+    async def read_token_with_ttl(self, token: Optional[str]) -> Tuple[Optional[_TokenDataSchemaT], Optional[float]]:
+        if not token:
+            return None, None
+        now = datetime.now()
+        stmt = select(TokenStoreModel).where(TokenStoreModel.token == token, self._alive_clause(now))
         obj: TokenStoreModel = await self.db.async_scalar(stmt)
         if obj is None:
-            return None
-        # expire
-        if obj.create_time < datetime.now() - timedelta(seconds=self.expire_seconds):
-            await self.destroy_token(token=token)
-            return None
-        return self.TokenDataSchema.parse_raw(obj.data)
+            return None, None
+        expire_time = obj.expire_time
+        if expire_time is None and self.expire_seconds is not None:
+            expire_time = obj.create_time + timedelta(seconds=self.expire_seconds)
+            # expire
+            if expire_time < now:
+                await self.destroy_token(token=token)
+                return None, None
+        ttl = None if expire_time is None else (expire_time - now).total_seconds()
+        return self.codec.decode(obj.data, self.TokenDataSchema), ttl
 
     async def write_token(self, token_data: Union[_TokenDataSchemaT, dict]) -> str:
-        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
         token = secrets.token_urlsafe()
-        model = TokenStoreModel(token=token, data=obj.json())
+        await self.save_token(token, token_data)
+        return token
+
+    async def save_token(self, token: str, token_data: Union[_TokenDataSchemaT, dict]) -> None:
+        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
+        expire_time = None if self.expire_seconds is None else datetime.now() + timedelta(seconds=self.expire_seconds)
+        model = TokenStoreModel(token=token, data=self.codec.encode(obj), expire_time=expire_time, user_id=str(obj.id))
+        if self.batch_write:
+            await self._write_batch(model)
+            return
         self.db.add(model)
         await self.db.async_flush()
-        return token
+
+    async def _write_batch(self, model: TokenStoreModel) -> None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._batch.append((model.dict(exclude={"id"}), future))
+        if len(self._batch) >= self.batch_max_size:
+            self._flush_batch()
+        elif self._batch_timer is None:
+            self._batch_timer = loop.call_later(self.batch_max_latency, self._flush_batch)
+        await future
+
+    def _flush_batch(self) -> None:
+        if self._batch_timer is not None:
+            self._batch_timer.cancel()
+            self._batch_timer = None
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+        task = asyncio.create_task(self._insert_batch(batch))
+        self._batch_tasks.add(task)  # 保持引用,防止任务被回收
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _insert_batch(self, batch: List[Tuple[dict, asyncio.Future]]) -> None:
+        try:
+            async with self.db():
+                await self.db.async_execute(insert(TokenStoreModel).values([values for values, _ in batch]))
+                await self.db.async_commit()
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
 
     async def destroy_token(self, token: str) -> None:
         stmt = delete(TokenStoreModel).where(TokenStoreModel.token == token)
         await self.db.async_execute(stmt)
         await self.db.async_flush()
+
+    async def list_user_tokens(self, user_id: Any) -> List[str]:
+        stmt = select(TokenStoreModel.token).where(TokenStoreModel.user_id == str(user_id), self._alive_clause(datetime.now()))
+        return list((await self.db.async_scalars(stmt)).all())
+
+    async def destroy_user_tokens(self, user_id: Any) -> None:
+        stmt = delete(TokenStoreModel).where(TokenStoreModel.user_id == str(user_id))
+        await self.db.async_execute(stmt)
+        await self.db.async_flush()
+
+    async def get_user_version(self, user_id: Any) -> int:
+        stmt = select(TokenVersionModel.version).where(TokenVersionModel.user_id == str(user_id))
+        return await self.db.async_scalar(stmt) or 0
+
+    async def incr_user_version(self, user_id: Any) -> int:
+        """Bump the version in the current session, it is committed together with the user modification."""
+        stmt = (
+            update(TokenVersionModel)
+            .where(TokenVersionModel.user_id == str(user_id))
+            .values(version=TokenVersionModel.version + 1)
+        )
+        if (await self.db.async_execute(stmt)).rowcount == 0:
+            self.db.add(TokenVersionModel(user_id=str(user_id), version=1))
+        await self.db.async_flush()
+        return await self.get_user_version(user_id)
+
+    async def delete_expired_tokens(self, batch_size: int = 1000) -> int:
+        """Delete expired tokens in batches of `batch_size` rows, return the number of deleted rows."""
+        deleted = 0
+        while True:
+            async with self.db():
+                stmt = select(TokenStoreModel.id).where(self._expired_clause(datetime.now())).limit(batch_size)
+                ids = (await self.db.async_scalars(stmt)).all()
+                if ids:
+                    await self.db.async_execute(delete(TokenStoreModel).where(TokenStoreModel.id.in_(ids)))
+                    await self.db.async_commit()
+            deleted += len(ids)
+            if len(ids) < batch_size:
+                return deleted
+            await asyncio.sleep(0)  # 让出事件循环,避免长时间占用
+
+    def start_reaper(self, interval: float = 60 * 10, batch_size: int = 1000) -> asyncio.Task:
+        """Start a background task that deletes expired tokens every `interval` seconds."""
+
+        async def reaper():
+            while True:
+                try:
+                    await self.delete_expired_tokens(batch_size=batch_size)
+                except Exception:  # 下次继续清理
+                    logger.exception("Failed to delete expired tokens")
+                await asyncio.sleep(interval)
+
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(reaper())
+        return self._reaper
+
+    async def stop_reaper(self) -> None:
+        if self._reaper is None:
+            return
+        self._reaper.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._reaper
+        self._reaper = None
+
+
+class DbRevocationStore(BaseRevocationStore):
+    """Revoked token ids stored in the `auth_token_revoked` table.
+
+    Entries are loaded by `create_time`, re-reading the last `overlap` seconds so that
+    rows committed slightly out of order are not missed.
+    """
+
+    def __init__(self, db: Union[AsyncDatabase, Database], overlap: float = 10):
+        self.db = db
+        self.overlap = overlap
+
+    async def add(self, jti: str, exp: int) -> None:
+        with contextlib.suppress(IntegrityError):  # 重复撤销
+            async with self.db():
+                self.db.add(TokenRevokedModel(jti=jti, exp=exp))
+                await self.db.async_commit()
+
+    async def load(self, cursor: Any = None) -> Tuple[List[Tuple[str, int]], Any]:
+        stmt = select(TokenRevokedModel.jti, TokenRevokedModel.exp, TokenRevokedModel.create_time).where(
+            TokenRevokedModel.exp >= int(time.time())
+        )
+        if cursor is not None:
+            stmt = stmt.where(TokenRevokedModel.create_time >= cursor - timedelta(seconds=self.overlap))
+        stmt = stmt.order_by(TokenRevokedModel.create_time)
+        async with self.db():
+            rows = (await self.db.async_execute(stmt)).all()
+        for row in rows:
+            cursor = row.create_time if cursor is None else max(cursor, row.create_time)
+        return [(row.jti, row.exp) for row in rows], cursor
+
+    async def delete_expired(self) -> None:
+        async with self.db():
+            await self.db.async_execute(delete(TokenRevokedModel).where(TokenRevokedModel.exp < int(time.time())))
+            await self.db.async_commit()
@@ -1,36 +1,166 @@
+import hashlib
+import logging
+import secrets
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
-from jose import JWTError, jwt
+from jose import JWTError, jwk, jwt
+from jose.constants import ALGORITHMS
 
-from ..backends.base import BaseTokenStore, _TokenDataSchemaT
+from ...utils.cache import TTLCache
+from ..backends.base import BaseRevocationStore, BaseTokenStore, _TokenDataSchemaT
+
+logger = logging.getLogger(__name__)
 
 
 class JwtTokenStore(BaseTokenStore):
+    """Stateless token store using JSON Web Tokens.
+
+    Keys are parsed once, and verified claims are cached by token digest until the token's `exp`,
+    so repeated requests with the same token skip signature verification and validation.
+    For asymmetric algorithms, pass the private key as `secret_key` and optionally the `public_key`.
+
+    Tokens carry `jti` and `iat` claims. `destroy_token` adds the `jti` to an in-memory revocation set
+    that is pruned once tokens expire, and `destroy_user_tokens` sets a per-user "not before" time that
+    rejects every token issued earlier. With a `revocation_store`, revocations are shared with other
+    processes, which catch up every `revocation_sync_interval` seconds and delete the expired entries of the store
+    every `revocation_prune_interval` seconds.
+    """
+
     def __init__(
         self,
         secret_key: str,
         algorithm: str = "HS256",
         expire_seconds: Optional[int] = 60 * 60 * 24 * 3,
         TokenDataSchema: _TokenDataSchemaT = None,
+        *,
+        public_key: Optional[str] = None,
+        cache_maxsize: int = 10000,
+        revocation_store: Optional[BaseRevocationStore] = None,
+        revocation_sync_interval: float = 5,
+        revocation_prune_interval: float = 60 * 10,
     ):
         super().__init__(expire_seconds, TokenDataSchema)
         self.secret_key = secret_key
         self.algorithm = algorithm
+        self.sign_key = jwk.construct(secret_key, algorithm)
+        if public_key is not None:
+            self.verify_key = jwk.construct(public_key, algorithm)
+        elif algorithm in ALGORITHMS.HMAC:
+            self.verify_key = self.sign_key
+        else:  # 预先解析公钥,避免每次验证时从私钥导出
+            self.verify_key = self.sign_key.public_key()
+        self.cache = TTLCache(maxsize=cache_maxsize) if cache_maxsize else None
+        self.revocation_store = revocation_store
+        self.revocation_sync_interval = revocation_sync_interval
+        self.revocation_prune_interval = revocation_prune_interval
+        self.revoked: Dict[str, int] = {}  # jti -> exp
+        self.not_before: Dict[str, float] = {}  # str(user_id) -> 在此时间之前签发的token无效
+        self._revocation_cursor: Any = None
+        self._next_sync = 0.0
+        self._next_prune = 0.0
 
-    async def read_token(self, token: str) -> Optional[_TokenDataSchemaT]:
+    def _decode(self, token: str) -> Optional[Dict[str, Any]]:
         try:
-            payload = jwt.decode(token, self.secret_key, algorithms=self.algorithm)
-            return self.TokenDataSchema.parse_obj(payload)
+            return jwt.decode(token, self.verify_key, algorithms=self.algorithm)
         except JWTError:
             return None
 
+    async def read_token(self, token: str) -> Optional[_TokenDataSchemaT]:
+        return (await self.read_token_with_ttl(token))[0]
+
+    async def read_token_with_ttl(self, token: Optional[str]) -> Tuple[Optional[_TokenDataSchemaT], Optional[float]]:
+        if not token:
+            return None, None
+        if time.monotonic() >= self._next_sync:
+            await self.sync_revocations()
+        if self.cache is not None:
+            key = hashlib.sha256(token.encode()).digest()
+            item = self.cache.get(key)
+            if item is not None:
+                exp, jti, iat, data = item
+                if jti in self.revoked or (self.not_before and iat < self.not_before.get(str(data.id), 0)):
+                    return None, None
+                if exp is None or exp >= int(time.time()):  # 与jwt.decode的过期判断保持一致
+                    return data, self._ttl(exp)
+                self.cache.pop(key)
+                return None, None
+        payload = self._decode(token)
+        if payload is None:
+            return None, None
+        jti = payload.get("jti")
+        if jti in self.revoked:
+            return None, None
+        data = self.TokenDataSchema.parse_obj(payload)
+        iat = payload.get("iat") or 0
+        if self.not_before and iat < self.not_before.get(str(data.id), 0):
+            return None, None
+        exp = payload.get("exp")
+        if self.cache is not None:
+            self.cache.set(key, (exp, jti, iat, data), ttl=None if exp is None else exp - time.time() + 1)
+        return data, self._ttl(exp)
+
+    @staticmethod
+    def _ttl(exp: Optional[int]) -> Optional[float]:
+        return None if exp is None else max(exp + 1 - time.time(), 0)
+
     async def write_token(self, token_data: Union[_TokenDataSchemaT, dict]) -> str:
         obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
         data = obj.dict()
         expire = datetime.now() + timedelta(seconds=self.expire_seconds)
-        data.update({"exp": expire})
-        return jwt.encode(data, self.secret_key, algorithm=self.algorithm)
+        data.update({"exp": expire, "iat": time.time(), "jti": secrets.token_urlsafe(16)})
+        return jwt.encode(data, self.sign_key, algorithm=self.algorithm)
 
     async def destroy_token(self, token: str) -> None:
-        raise NotImplementedError
+        payload = self._decode(token)
+        if not payload or not payload.get("jti"):  # 无效token或者旧版本token没有jti
+            return
+        jti, exp = payload["jti"], int(payload.get("exp") or time.time() + (self.expire_seconds or 0))
+        self.revoked[jti] = exp
+        if self.cache is not None:
+            self.cache.pop(hashlib.sha256(token.encode()).digest())
+        if self.revocation_store is not None:
+            await self.revocation_store.add(jti, exp)
+
+    async def list_user_tokens(self, user_id: Any) -> List[str]:
+        raise NotImplementedError("JwtTokenStore is stateless and cannot list the tokens of a user")
+
+    async def destroy_user_tokens(self, user_id: Any) -> None:
+        not_before = time.time()
+        self.not_before[str(user_id)] = not_before
+        if self.revocation_store is not None:
+            # 所有在not_before之前签发的token最迟在expire_seconds后过期
+            exp = int(not_before + (self.expire_seconds or 0)) + 1
+            await self.revocation_store.add(f"user:{not_before!r}:{user_id}", exp)  # 用户id放在最后,可以包含任意字符
+
+    async def sync_revocations(self) -> None:
+        """Load new revocations from the revocation store and prune the expired ones."""
+        self._next_sync = time.monotonic() + self.revocation_sync_interval
+        entries = []
+        if self.revocation_store is not None:
+            try:
+                entries, self._revocation_cursor = await self.revocation_store.load(self._revocation_cursor)
+            except Exception:  # 下次同步时重试
+                logger.exception("Failed to load revoked tokens")
+            if time.monotonic() >= self._next_prune:  # 删除存储中已过期的记录,避免表无限增长
+                self._next_prune = time.monotonic() + self.revocation_prune_interval
+                try:
+                    await self.revocation_store.delete_expired()
+                except Exception:
+                    logger.exception("Failed to delete expired revoked tokens")
+        now = int(time.time())
+        revoked = {jti: exp for jti, exp in self.revoked.items() if exp >= now}
+        not_before = {
+            user_id: timestamp
+            for user_id, timestamp in self.not_before.items()
+            if self.expire_seconds is None or timestamp + self.expire_seconds >= now
+        }
+        for jti, exp in entries:
+            if jti.startswith("user:"):
+                _, timestamp, user_id = jti.split(":", 2)
+                not_before[user_id] = max(not_before.get(user_id, 0), float(timestamp))
+            else:
+                revoked[jti] = exp
+        self.revoked = revoked
+        self.not_before = not_before
@@ -0,0 +1,59 @@
+import secrets
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from ...utils.cache import TTLCache
+from ..backends.base import BaseTokenStore, _TokenDataSchemaT
+
+
+class MemoryTokenStore(BaseTokenStore):
+    """Process-local token store.
+
+    Tokens are lost on restart and are not shared between workers, so use it as the first tier
+    of a `TieredTokenStore` or in tests. The least recently used tokens are evicted beyond `maxsize`.
+    """
+
+    def __init__(
+        self,
+        expire_seconds: Optional[int] = 60 * 60 * 24 * 3,
+        TokenDataSchema: _TokenDataSchemaT = None,
+        maxsize: int = 100000,
+    ):
+        super().__init__(expire_seconds, TokenDataSchema)
+        self.cache = TTLCache(maxsize=maxsize, ttl=expire_seconds)
+        self.user_versions: Dict[str, int] = {}
+
+    async def read_token(self, token: Optional[str]) -> Optional[_TokenDataSchemaT]:
+        if not token:
+            return None
+        return self.cache.get(token)
+
+    async def read_token_with_ttl(self, token: Optional[str]) -> Tuple[Optional[_TokenDataSchemaT], Optional[float]]:
+        data = await self.read_token(token)
+        return data, None if data is None else self.cache.remaining(token)
+
+    async def write_token(self, token_data: Union[_TokenDataSchemaT, dict]) -> str:
+        token = secrets.token_urlsafe()
+        await self.save_token(token, token_data)
+        return token
+
+    async def save_token(self, token: str, token_data: Union[_TokenDataSchemaT, dict]) -> None:
+        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
+        self.cache.set(token, obj)
+
+    async def destroy_token(self, token: str) -> None:
+        self.cache.pop(token)
+
+    async def list_user_tokens(self, user_id: Any) -> List[str]:
+        return [token for token, data in self.cache.items() if data.id == user_id and token in self.cache]
+
+    async def destroy_user_tokens(self, user_id: Any) -> None:
+        for token, data in self.cache.items():
+            if data.id == user_id:
+                self.cache.pop(token)
+
+    async def get_user_version(self, user_id: Any) -> int:
+        return self.user_versions.get(str(user_id), 0)
+
+    async def incr_user_version(self, user_id: Any) -> int:
+        self.user_versions[str(user_id)] = self.user_versions.get(str(user_id), 0) + 1
+        return self.user_versions[str(user_id)]
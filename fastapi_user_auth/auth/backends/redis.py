@@ -1,30 +1,206 @@
 import secrets
-from typing import Optional, Union
+import time
+from typing import Any, List, Optional, Sequence, Tuple, Union
 
 from redis.asyncio import Redis
 
-from ..backends.base import BaseTokenStore, _TokenDataSchemaT
+from ...utils.cache import TTLCache
+from ..backends.base import BaseRevocationStore, BaseTokenStore, _TokenDataSchemaT
+from ..backends.codec import BaseTokenCodec
+
+# 在一次请求中删除用户索引及其中的全部token
+DESTROY_USER_TOKENS_SCRIPT = """
+local tokens = redis.call('SMEMBERS', KEYS[1])
+for _, token in ipairs(tokens) do
+    redis.call('DEL', ARGV[1] .. token)
+end
+redis.call('DEL', KEYS[1])
+return #tokens
+"""
 
 
 class RedisTokenStore(BaseTokenStore):
-    def __init__(self, redis: Redis, expire_seconds: Optional[int] = 60 * 60 * 24 * 3, TokenDataSchema: _TokenDataSchemaT = None):
-        super().__init__(expire_seconds, TokenDataSchema)
+    """Token store backed by redis.
+
+    With `sliding_expiration=True`, every read refreshes the token's ttl in the same round trip (`GETEX`, redis>=6.2).
+    Tokens are also indexed per user in a set, so all sessions of a user can be listed or destroyed at once.
+    The index expires with the user's longest-lived token; in sliding mode its ttl is renewed by reads,
+    at most once per user every `expire_seconds / 2` in each process.
+    """
+
+    # 在滑动过期模式下,用户索引集合超过该数量时清理已失效的token
+    user_index_prune_size: int = 64
+
+    def __init__(
+        self,
+        redis: Redis,
+        expire_seconds: Optional[int] = 60 * 60 * 24 * 3,
+        TokenDataSchema: _TokenDataSchemaT = None,
+        *,
+        codec: BaseTokenCodec = None,
+        sliding_expiration: bool = False,
+    ):
+        super().__init__(expire_seconds, TokenDataSchema, codec)
         self.redis = redis
+        self.sliding_expiration = sliding_expiration and bool(expire_seconds)
+        # 滑动过期模式下,用户索引的过期时间比token多出一个刷新周期
+        self._index_refresh = TTLCache(maxsize=100000, ttl=expire_seconds / 2) if self.sliding_expiration else None
+        self._destroy_user_tokens = redis.register_script(DESTROY_USER_TOKENS_SCRIPT)
+
+    @property
+    def user_index_expire_seconds(self) -> Optional[int]:
+        if not self.expire_seconds:
+            return None
+        return int(self.expire_seconds * 1.5) + 1 if self.sliding_expiration else self.expire_seconds
 
     async def read_token(self, token: str) -> Optional[_TokenDataSchemaT]:
-        data = await self.redis.get(self.get_key(token))
+        if self.sliding_expiration:
+            data = await self.redis.getex(self.get_key(token), ex=self.expire_seconds)
+        else:
+            data = await self.redis.get(self.get_key(token))
         if data is None:
             return None
-        return self.TokenDataSchema.parse_raw(data)
+        obj = self.codec.decode(data, self.TokenDataSchema)
+        if self.sliding_expiration:
+            await self._refresh_user_index(obj.id)
+        return obj
+
+    async def _refresh_user_index(self, user_id: Any) -> None:
+        key = str(user_id)
+        if key not in self._index_refresh:
+            self._index_refresh.set(key, True)
+            await self.redis.expire(self.get_user_key(user_id), self.user_index_expire_seconds)
+
+    async def read_token_with_ttl(self, token: Optional[str]) -> Tuple[Optional[_TokenDataSchemaT], Optional[float]]:
+        if not token or self.sliding_expiration:  # 滑动过期模式下读取后剩余时间为expire_seconds
+            return await self.read_token(token), self.expire_seconds
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.get(self.get_key(token))
+            pipe.pttl(self.get_key(token))
+            data, pttl = await pipe.execute()
+        if data is None:
+            return None, None
+        return self.codec.decode(data, self.TokenDataSchema), None if pttl < 0 else pttl / 1000
+
+    async def read_tokens(self, tokens: Sequence[str]) -> List[Optional[_TokenDataSchemaT]]:
+        """Read several tokens in one round trip, keeping the order of `tokens`."""
+        if not tokens:
+            return []
+        keys = [self.get_key(token) for token in tokens]
+        if self.sliding_expiration:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.getex(key, ex=self.expire_seconds)
+                values = await pipe.execute()
+        else:
+            values = await self.redis.mget(keys)
+        objs = [None if data is None else self.codec.decode(data, self.TokenDataSchema) for data in values]
+        if self.sliding_expiration:
+            for user_id in {obj.id for obj in objs if obj is not None}:
+                await self._refresh_user_index(user_id)
+        return objs
 
     async def write_token(self, token_data: Union[_TokenDataSchemaT, dict]) -> str:
-        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
         token = secrets.token_urlsafe()
-        await self.redis.set(self.get_key(token), obj.json(), ex=self.expire_seconds)
+        await self.save_token(token, token_data)
         return token
 
+    async def save_token(self, token: str, token_data: Union[_TokenDataSchemaT, dict]) -> None:
+        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
+        user_key = self.get_user_key(obj.id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(self.get_key(token), self.codec.encode(obj), ex=self.expire_seconds)
+            pipe.sadd(user_key, token)
+            if self.user_index_expire_seconds:
+                pipe.expire(user_key, self.user_index_expire_seconds)
+            pipe.scard(user_key)
+            *_, size = await pipe.execute()
+        if self.sliding_expiration:
+            self._index_refresh.set(str(obj.id), True)
+        if size > self.user_index_prune_size:
+            await self.list_user_tokens(obj.id)
+
     async def destroy_token(self, token: str) -> None:
+        # 用户索引中的失效token会在读取索引时清理
         await self.redis.delete(self.get_key(token))
 
+    async def destroy_tokens(self, tokens: Sequence[str]) -> None:
+        if tokens:
+            await self.redis.delete(*[self.get_key(token) for token in tokens])
+
+    async def list_user_tokens(self, user_id: Any) -> List[str]:
+        """Return the live tokens of a user, pruning destroyed or expired ones from the index."""
+        user_key = self.get_user_key(user_id)
+        tokens = [token.decode() if isinstance(token, bytes) else token for token in await self.redis.smembers(user_key)]
+        if not tokens:
+            return []
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for token in tokens:
+                pipe.exists(self.get_key(token))
+            exists = await pipe.execute()
+        dead = [token for token, alive in zip(tokens, exists) if not alive]
+        if dead:
+            await self.redis.srem(user_key, *dead)
+        return [token for token, alive in zip(tokens, exists) if alive]
+
+    async def destroy_user_tokens(self, user_id: Any) -> None:
+        """Destroy every session of a user in one round trip."""
+        await self._destroy_user_tokens(keys=[self.get_user_key(user_id)], args=[self.get_key("")])
+
+    async def get_user_version(self, user_id: Any) -> int:
+        return int(await self.redis.get(self.get_user_version_key(user_id)) or 0)
+
+    async def incr_user_version(self, user_id: Any) -> int:
+        key = self.get_user_version_key(user_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.incr(key)
+            # 旧版本的token过期后,版本号可以过期;滑动过期模式下token的有效期不确定,版本号不过期
+            if self.expire_seconds and not self.sliding_expiration:
+                pipe.expire(key, self.expire_seconds)
+            version, *_ = await pipe.execute()
+        return version
+
     def get_key(self, token: str):
         return f"auth:token:{token}"
+
+    def get_user_key(self, user_id: Any):
+        return f"auth:user_tokens:{user_id}"
+
+    def get_user_version_key(self, user_id: Any):
+        return f"auth:user_version:{user_id}"
+
+
+class RedisRevocationStore(BaseRevocationStore):
+    """Revoked token ids stored in a sorted set, scored by the redis server time of revocation."""
+
+    def __init__(self, redis: Redis, key: str = "auth:token:revoked", overlap: float = 10):
+        self.redis = redis
+        self.key = key
+        self.overlap = overlap
+
+    async def add(self, jti: str, exp: int) -> None:
+        seconds, microseconds = await self.redis.time()
+        await self.redis.zadd(self.key, {f"{jti}:{exp}": seconds + microseconds / 1e6})
+
+    async def load(self, cursor: Any = None) -> Tuple[List[Tuple[str, int]], Any]:
+        start = "-inf" if cursor is None else cursor - self.overlap
+        items = await self.redis.zrangebyscore(self.key, start, "+inf", withscores=True)
+        now, entries, expired = int(time.time()), [], []
+        for member, score in items:
+            member = member.decode() if isinstance(member, bytes) else member
+            jti, exp = member.rsplit(":", 1)
+            if int(exp) < now:
+                expired.append(member)
+                continue
+            entries.append((jti, int(exp)))
+            cursor = score if cursor is None else max(cursor, score)
+        if expired:
+            await self.redis.zrem(self.key, *expired)
+        return entries, cursor
+
+    async def delete_expired(self) -> None:
+        now = int(time.time())
+        members = [member.decode() if isinstance(member, bytes) else member for member in await self.redis.zrange(self.key, 0, -1)]
+        expired = [member for member in members if int(member.rsplit(":", 1)[1]) < now]
+        if expired:
+            await self.redis.zrem(self.key, *expired)
@@ -0,0 +1,164 @@
+import asyncio
+import contextlib
+import logging
+import secrets
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from ..backends.base import BaseTokenStore, _TokenDataSchemaT
+
+logger = logging.getLogger(__name__)
+
+
+class TieredTokenStore(BaseTokenStore):
+    """Chain of token stores ordered from fastest to most durable, e.g. memory -> redis -> database.
+
+    Reads try each tier in order and copy hits into the faster tiers. Every tier keeps its own
+    `expire_seconds`, so give the faster tiers a shorter ttl: a promoted token lives there for at most that long.
+    A hit is not copied into a faster tier whose ttl is longer than the time the token has left.
+    Writes go to every tier, the last one first. With `write_behind=True` only the first tier is written
+    in the request, the others are written by a background task; when more than `queue_maxsize` tokens are
+    pending, writes fall back to write-through. Use `DbTokenStore(batch_write=True)` as a write-behind tier,
+    so background writes are committed in their own session.
+
+    A tier that raises is skipped for `retry_interval` seconds. The last tier is the source of truth and is never
+    skipped, its errors are raised. Destroys are sent to every tier regardless of health; a token destroyed while
+    a tier is unreachable stays readable there until its ttl expires.
+    """
+
+    def __init__(
+        self,
+        tiers: Sequence[BaseTokenStore],
+        *,
+        write_behind: bool = False,
+        queue_maxsize: int = 1000,
+        retry_interval: float = 30,
+    ):
+        assert tiers, "TieredTokenStore requires at least one tier"
+        super().__init__(tiers[-1].expire_seconds, tiers[-1].TokenDataSchema)
+        self.tiers = list(tiers)
+        self.write_behind = write_behind and len(self.tiers) > 1
+        self.queue_maxsize = queue_maxsize
+        self.retry_interval = retry_interval
+        self._down_until = [0.0] * len(self.tiers)
+        self._pending: Dict[str, _TokenDataSchemaT] = {}  # 等待后台写入的token
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def is_healthy(self, index: int) -> bool:
+        return index == len(self.tiers) - 1 or self._down_until[index] <= time.monotonic()
+
+    async def _call(self, index: int, method: str, *args, force: bool = False) -> Any:
+        """Call `method` on a tier, return `None` and mark the tier down if it fails.
+        Errors of the last tier are raised."""
+        if not force and not self.is_healthy(index):
+            return None
+        try:
+            return await getattr(self.tiers[index], method)(*args)
+        except Exception as e:
+            if index == len(self.tiers) - 1:
+                raise
+            logger.warning("Token store tier %d (%s) is unavailable: %r", index, type(self.tiers[index]).__name__, e)
+            self._down_until[index] = time.monotonic() + self.retry_interval
+            return None
+
+    async def read_token(self, token: Optional[str]) -> Optional[_TokenDataSchemaT]:
+        return (await self.read_token_with_ttl(token))[0]
+
+    async def read_token_with_ttl(self, token: Optional[str]) -> Tuple[Optional[_TokenDataSchemaT], Optional[float]]:
+        if not token:
+            return None, None
+        for index in range(len(self.tiers)):
+            data, ttl = await self._call(index, "read_token_with_ttl", token) or (None, None)
+            if data is not None:
+                for upper in range(index):  # 提升到更快的层
+                    if self._outlives(self.tiers[upper], ttl):
+                        continue  # 更快的层会在下层过期后继续保留token
+                    await self._call(upper, "save_token", token, data)
+                return data, ttl
+        return None, None
+
+    @staticmethod
+    def _outlives(tier: BaseTokenStore, ttl: Optional[float]) -> bool:
+        """Whether a copy saved in `tier` would outlive the `ttl` seconds left in the tier it was read from."""
+        return ttl is not None and (tier.expire_seconds is None or tier.expire_seconds > ttl)
+
+    async def write_token(self, token_data: Union[_TokenDataSchemaT, dict]) -> str:
+        token = secrets.token_urlsafe()
+        await self.save_token(token, token_data)
+        return token
+
+    async def save_token(self, token: str, token_data: Union[_TokenDataSchemaT, dict]) -> None:
+        obj = self.TokenDataSchema.parse_obj(token_data) if isinstance(token_data, dict) else token_data
+        last = len(self.tiers) - 1
+        indexes = range(last, -1, -1)
+        if self.write_behind and self.is_healthy(0):
+            await self._call(0, "save_token", token, obj)
+            if self.is_healthy(0):  # 第一层写入成功,否则同步写入其余层
+                if self._enqueue(token, obj):
+                    return
+                indexes = range(last, 0, -1)  # 队列已满,同步写入其余层
+        for index in indexes:
+            await self._call(index, "save_token", token, obj)
+
+    def _enqueue(self, token: str, obj: _TokenDataSchemaT) -> bool:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_maxsize)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._write_behind_worker())
+        try:
+            self._queue.put_nowait(token)
+        except asyncio.QueueFull:
+            return False
+        self._pending[token] = obj
+        return True
+
+    async def _write_behind_worker(self) -> None:
+        while True:
+            token = await self._queue.get()
+            try:
+                obj = self._pending.pop(token, None)
+                if obj is None:  # 写入前已被销毁
+                    continue
+                for index in range(len(self.tiers) - 1, 0, -1):
+                    await self._call(index, "save_token", token, obj)
+            except Exception:
+                logger.exception("Failed to write token to the durable tier")
+            finally:
+                self._queue.task_done()
+
+    async def flush(self) -> None:
+        """Wait until every pending write-behind token is written."""
+        if self._queue is not None and self._worker is not None and not self._worker.done():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Flush pending writes and stop the write-behind task, e.g. on application shutdown."""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+    async def destroy_token(self, token: str) -> None:
+        self._pending.pop(token, None)
+        for index in range(len(self.tiers)):
+            await self._call(index, "destroy_token", token, force=True)
+
+    async def list_user_tokens(self, user_id: Any) -> List[str]:
+        tokens = await self.tiers[-1].list_user_tokens(user_id)
+        return tokens + [token for token, data in self._pending.items() if data.id == user_id and token not in tokens]
+
+    async def destroy_user_tokens(self, user_id: Any) -> None:
+        for token, data in list(self._pending.items()):
+            if data.id == user_id:
+                self._pending.pop(token, None)
+        for index in range(len(self.tiers)):
+            await self._call(index, "destroy_user_tokens", user_id, force=True)
+
+    async def get_user_version(self, user_id: Any) -> int:
+        return await self.tiers[-1].get_user_version(user_id)
+
+    async def incr_user_version(self, user_id: Any) -> int:
+        return await self.tiers[-1].incr_user_version(user_id)
@@ -0,0 +1,158 @@
+import asyncio
+import functools
+import math
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional, Tuple
+
+from fastapi_amis_admin.utils.translation import i18n as _
+from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
+
+from .exceptions import AuthError, ErrorCode
+
+# 未指定min_rounds时的哈希成本安全下限
+MIN_ROUNDS = {"bcrypt": 10, "argon2": 2}
+
+HasherInfo = namedtuple("HasherInfo", ["calls", "rejected", "pending", "wait_seconds", "hash_seconds", "max_wait", "max_hash"])
+
+
+@functools.lru_cache(maxsize=8)
+def _load_context(config: str) -> CryptContext:
+    return CryptContext.from_string(config)
+
+
+def _timed(func: Callable, *args) -> Tuple[Any, float]:
+    start = time.perf_counter()
+    return func(*args), time.perf_counter() - start
+
+
+def _timed_in_process(config: str, method: str, *args) -> Tuple[Any, float]:
+    # 子进程中根据配置重建CryptContext,避免序列化上下文对象
+    return _timed(getattr(_load_context(config), method), *args)
+
+
+class PasswordHasher:
+    """Hash and verify passwords on a bounded executor, off the event loop.
+
+    At most `max_pending` calls may be queued or running; further calls fail immediately with
+    `AuthError(ErrorCode.SYSTEM_BUSY)` instead of piling up behind a saturated pool.
+    The executor defaults to a thread pool of `max_workers` threads (bcrypt releases the GIL);
+    pass a `ProcessPoolExecutor` for hashes that hold it.
+    """
+
+    def __init__(
+        self,
+        pwd_context: CryptContext,
+        executor: Executor = None,
+        *,
+        max_workers: int = None,
+        max_pending: int = 64,
+    ):
+        self.pwd_context = pwd_context
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending
+        self._executor = executor
+        self.pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.max_wait = 0.0
+        self.max_hash = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="password-hasher")
+        return self._executor
+
+    async def run(self, method: str, *args) -> Any:
+        """Call `method` of the CryptContext in the executor."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise AuthError(status=ErrorCode.SYSTEM_BUSY, msg=_("The system is busy"))
+        if isinstance(self.executor, ProcessPoolExecutor):
+            func = functools.partial(_timed_in_process, self.pwd_context.to_string(), method, *args)
+        else:
+            func = functools.partial(_timed, getattr(self.pwd_context, method), *args)
+        self.pending += 1
+        start = time.perf_counter()
+        try:
+            result, hash_seconds = await asyncio.get_running_loop().run_in_executor(self.executor, func)
+        finally:
+            self.pending -= 1
+        wait_seconds = max(time.perf_counter() - start - hash_seconds, 0.0)
+        self.calls += 1
+        self.wait_seconds += wait_seconds
+        self.hash_seconds += hash_seconds
+        self.max_wait = max(self.max_wait, wait_seconds)
+        self.max_hash = max(self.max_hash, hash_seconds)
+        return result
+
+    async def hash(self, secret: str) -> str:
+        return await self.run("hash", secret)
+
+    async def verify(self, secret: str, hash: Optional[str]) -> bool:
+        return await self.run("verify", secret, hash)
+
+    async def verify_and_update(self, secret: str, hash: Optional[str]) -> Tuple[bool, Optional[str]]:
+        """Verify a password, and return a new hash if the stored one uses a deprecated scheme or a lower cost."""
+        return await self.run("verify_and_update", secret, hash)
+
+    def info(self) -> HasherInfo:
+        """Return call counters, current queue depth and the total/max queue wait and hash time in seconds."""
+        return HasherInfo(
+            self.calls, self.rejected, self.pending, self.wait_seconds, self.hash_seconds, self.max_wait, self.max_hash
+        )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def calibrate_crypt_context(
+    pwd_context: CryptContext,
+    target_seconds: float = 0.25,
+    *,
+    scheme: str = None,
+    min_rounds: int = None,
+    max_rounds: int = None,
+    samples: int = 3,
+) -> CryptContext:
+    """Return a copy of `pwd_context` whose cost makes one hash take about `target_seconds` on this machine.
+
+    The cost (bcrypt rounds, argon2 time_cost, ...) of `scheme` never goes below `min_rounds`.
+    It also becomes the minimum cost, so `verify_and_update` upgrades weaker hashes on the next login.
+    """
+    scheme = scheme or pwd_context.default_scheme()
+    handler = get_crypt_handler(scheme)  # 原始算法,不受当前上下文中成本限制的影响
+    if "rounds" not in handler.setting_kwds:
+        raise ValueError(f"The cost of {scheme} can not be configured")
+    floor = max(MIN_ROUNDS.get(scheme, handler.default_rounds) if min_rounds is None else min_rounds, handler.min_rounds)
+    ceiling = min(filter(None, [max_rounds, handler.max_rounds]), default=None)
+
+    def measure(rounds: int) -> float:
+        hash_ = handler.using(rounds=rounds).hash
+        return min(_timed(hash_, "calibration")[1] for _ in range(samples))
+
+    elapsed = measure(floor)
+    if handler.rounds_cost == "log2":  # 每增加一轮,耗时翻倍
+        rounds = floor + max(int(math.log2(target_seconds / elapsed)), 0)
+    else:
+        rounds = max(int(floor * target_seconds / elapsed), floor)
+    if ceiling is not None:
+        rounds = min(rounds, ceiling)
+    # 移除原有的成本配置(如rounds会同时限制最小与最大成本)
+    settings = {
+        key: value for key, value in pwd_context.to_dict().items() if not (key.startswith(f"{scheme}__") and "rounds" in key)
+    }
+    settings.update(
+        schemes=[scheme] + [name for name in pwd_context.schemes() if name != scheme],
+        default=scheme,
+        **{f"{scheme}__default_rounds": rounds, f"{scheme}__min_rounds": rounds},
+    )
+    return CryptContext(**settings)
@@ -0,0 +1,109 @@
+import asyncio
+import contextlib
+import logging
+from collections import namedtuple
+from typing import List, Optional, Union
+
+from sqlalchemy import insert
+from sqlalchemy_database import AsyncDatabase, Database
+
+from .models import LoginHistory
+
+logger = logging.getLogger(__name__)
+
+HistoryWriterInfo = namedtuple("HistoryWriterInfo", ["written", "dropped", "failed", "pending"])
+
+
+class LoginHistoryWriter:
+    """Buffer login history rows in memory and insert them in batches from a background task.
+
+    Rows are inserted with one multi-row INSERT once `batch_max_size` rows are pending, or `flush_interval`
+    seconds after the first one. When `queue_maxsize` rows are waiting, `policy="drop"` discards new rows
+    and `policy="block"` makes the login wait for room in the queue.
+    Call `close()` on shutdown to flush the pending rows.
+    """
+
+    def __init__(
+        self,
+        db: Union[AsyncDatabase, Database],
+        *,
+        batch_max_size: int = 500,
+        flush_interval: float = 0.5,
+        queue_maxsize: int = 10000,
+        policy: str = "drop",
+    ):
+        assert policy in ("drop", "block"), "policy must be 'drop' or 'block'"
+        self.db = db
+        self.batch_max_size = batch_max_size
+        self.flush_interval = flush_interval
+        self.queue_maxsize = queue_maxsize
+        self.policy = policy
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def write(self, history: LoginHistory) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_maxsize)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        values = history.dict(exclude={"id"})
+        if self.policy == "block":
+            await self._queue.put(values)
+            return
+        try:
+            self._queue.put_nowait(values)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_max_size:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._insert(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _insert(self, batch: List[dict]) -> None:
+        try:
+            async with self.db():
+                await self.db.async_execute(insert(LoginHistory).values(batch))
+                await self.db.async_commit()
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Failed to write %d login history rows", len(batch))
+        else:
+            self.written += len(batch)
+
+    async def flush(self) -> None:
+        """Wait until every pending row is written."""
+        if self._queue is not None and self._worker is not None and not self._worker.done():
+            await self._queue.join()
+
+    async def close(self) -> None:
+        """Flush the pending rows and stop the background task."""
+        await self.flush()
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+    def info(self) -> HistoryWriterInfo:
+        return HistoryWriterInfo(self.written, self.dropped, self.failed, 0 if self._queue is None else self._queue.qsize())
@@ -0,0 +1,31 @@
+from typing import TYPE_CHECKING
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+if TYPE_CHECKING:
+    from .auth import Auth
+
+# scope中的标记,表示request.user尚未加载
+USER_PENDING = "auth_user_pending"
+
+
+class LazyAuthenticationMiddleware:
+    """Pure ASGI middleware that sets `request.auth`, and `request.user` to `None` until the user is loaded.
+
+    Unlike starlette's `AuthenticationMiddleware`, the token and the user are only read when
+    `await request.auth.get_current_user(request)` is called, directly or through `Auth.requires` and its dependencies,
+    which then sets `request.user`. Code that reads `request.user` before that sees an anonymous user.
+    """
+
+    def __init__(self, app: ASGIApp, auth: "Auth"):
+        self.app = app
+        self.auth = auth
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] in ("http", "websocket"):
+            scope["auth"] = self.auth
+            if "user" not in scope:  # 外层应用已挂载中间件时保留其结果
+                scope["user"] = None
+                if not self.auth.backend.is_bypassed(scope["path"]):
+                    scope[USER_PENDING] = True
+        await self.app(scope, receive, send)
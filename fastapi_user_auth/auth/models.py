@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 
 from fastapi_amis_admin.amis.components import ColumnImage, InputImage
 from fastapi_amis_admin.crud.parser import LabelField
@@ -87,6 +87,30 @@ class CasbinRule(PkMixin, table=True):
         return f'<CasbinRule {self.id}: "{str(self)}">'
 
 
+class CasbinRuleChange(PkMixin, CreateTimeMixin, table=True):
+    """casbin规则变更记录,id即为策略版本号"""
+
+    __tablename__ = "auth_casbin_rule_change"
+
+    op: str = Field(title="Operation", max_length=10)  # add, remove, reset
+    ptype: str = Field("", title="Policy Type")
+    v0: Optional[str] = Field(None, title="Subject")
+    v1: Optional[str] = Field(None, title="Object")
+    v2: Optional[str] = Field(None, title="Action")
+    v3: Optional[str] = Field(None, title="Group")
+    v4: Optional[str] = Field(None, title="Effect")
+    v5: Optional[str] = Field(None)
+
+    @property
+    def rule(self) -> List[str]:
+        rule = []
+        for v in (self.v0, self.v1, self.v2, self.v3, self.v4, self.v5):
+            if v is None:
+                break
+            rule.append(v)
+        return rule
+
+
 """
 SELECT v0, GROUP_CONCAT(t.name) as roles, GROUP_CONCAT(t.key) as role_keys
 FROM (select v0, auth_role.name, auth_role.key
@@ -14,6 +14,16 @@ class BaseTokenData(BaseModel):
     username: str
 
 
+class UserSnapshotTokenData(BaseTokenData):
+    """Token data carrying a snapshot of the user, used by `Auth(user_snapshot=True)`"""
+
+    is_active: bool = True
+    nickname: Optional[str] = ""
+    email: Optional[str] = None
+    avatar: Optional[str] = ""
+    auth_version: int = 0  # 用户版本号,用户修改后快照失效
+
+
 class UserLoginOut(BaseUser):
     """用户登录返回信息"""
 
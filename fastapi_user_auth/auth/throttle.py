@@ -0,0 +1,133 @@
+import ipaddress
+import secrets
+import time
+from collections import deque
+from typing import Dict, Optional, Sequence
+
+from ..utils.cache import TTLCache
+
+
+class BaseThrottleBackend:
+    """Sliding window counters of login attempts."""
+
+    async def hit(self, limits: Dict[str, int], window: float) -> bool:
+        """Record an attempt for every key of `limits`, or return False without recording any
+        if one of the keys already has its limit of attempts within the last `window` seconds."""
+        raise NotImplementedError
+
+    async def reset(self, key: str) -> None:
+        raise NotImplementedError
+
+
+class MemoryThrottleBackend(BaseThrottleBackend):
+    """Process-local counters, the least recently used keys are evicted beyond `maxsize`."""
+
+    def __init__(self, maxsize: int = 100000):
+        self.cache = TTLCache(maxsize=maxsize)
+
+    async def hit(self, limits: Dict[str, int], window: float) -> bool:
+        now = time.monotonic()
+        counters = {}
+        for key, limit in limits.items():
+            attempts: Optional[deque] = self.cache.get(key)
+            if attempts is None:
+                attempts = deque(maxlen=limit)
+            while attempts and attempts[0] <= now - window:
+                attempts.popleft()
+            if len(attempts) >= limit:
+                return False
+            counters[key] = attempts
+        for key, attempts in counters.items():  # 全部检查通过后再记录
+            attempts.append(now)
+            self.cache.set(key, attempts, ttl=window)
+        return True
+
+    async def reset(self, key: str) -> None:
+        self.cache.pop(key)
+
+
+class RedisThrottleBackend(BaseThrottleBackend):
+    """Counters shared between workers, one sorted set of attempt timestamps per key."""
+
+    def __init__(self, redis, prefix: str = "auth:throttle:"):
+        self.redis = redis
+        self.prefix = prefix
+
+    async def hit(self, limits: Dict[str, int], window: float) -> bool:
+        keys, now = [self.prefix + key for key in limits], time.time()
+        member = f"{now}:{secrets.token_hex(4)}"
+        async with self.redis.pipeline(transaction=True) as pipe:
+            for key in keys:
+                pipe.zremrangebyscore(key, "-inf", now - window)
+                pipe.zadd(key, {member: now})
+                pipe.zcard(key)
+                pipe.expire(key, int(window) + 1)
+            results = await pipe.execute()
+        counts = results[2::4]
+        if any(count > limit for count, limit in zip(counts, limits.values())):
+            # 任一限制被拒绝时,本次尝试不计入任何窗口
+            async with self.redis.pipeline(transaction=True) as pipe:
+                for key in keys:
+                    pipe.zrem(key, member)
+                await pipe.execute()
+            return False
+        return True
+
+    async def reset(self, key: str) -> None:
+        await self.redis.delete(self.prefix + key)
+
+
+class LoginThrottle:
+    """Limit login attempts per username and per client ip within a sliding window.
+
+    Attempts are counted before the password is verified, so rejected attempts cost no hashing.
+    An attempt rejected by one limit is not counted by the other. A successful login resets the counter of its username.
+    Behind a reverse proxy, list its addresses or networks in `trusted_proxies`: for connections from them,
+    the client ip is the last untrusted address of the `X-Forwarded-For` chain (`forwarded_for`),
+    so the proxy must append to that header. Other proxy headers are ignored, clients can set them freely.
+    """
+
+    def __init__(
+        self,
+        backend: BaseThrottleBackend = None,
+        *,
+        username_limit: int = 10,
+        ip_limit: int = 100,
+        window: float = 60 * 5,
+        trusted_proxies: Sequence[str] = (),
+    ):
+        self.backend = backend or MemoryThrottleBackend()
+        self.username_limit = username_limit
+        self.ip_limit = ip_limit
+        self.window = window
+        self.trusted_proxies = [ipaddress.ip_network(proxy, strict=False) for proxy in trusted_proxies]
+
+    def is_trusted(self, ip: str) -> bool:
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return False
+        return any(address in network for network in self.trusted_proxies)
+
+    def get_client_ip(self, ip: str, forwarded_for: str = "") -> str:
+        """Return the ip to throttle, the connection ip unless it is a trusted proxy.
+        `forwarded_for`: the `X-Forwarded-For` header, scanned from the right starting at the connection ip."""
+        if not self.trusted_proxies or not self.is_trusted(ip):
+            return ip
+        # 从右向左查找第一个不受信任的地址,左侧的地址可能被客户端伪造
+        for address in reversed([address.strip() for address in forwarded_for.split(",")]):
+            if address and not self.is_trusted(address):
+                return address
+        return ip
+
+    async def allow(self, username: str, ip: str, forwarded_for: str = "") -> bool:
+        limits = {}
+        if self.username_limit:
+            limits[f"user:{username}"] = self.username_limit
+        ip = self.get_client_ip(ip, forwarded_for)
+        if self.ip_limit and ip:
+            limits[f"ip:{ip}"] = self.ip_limit
+        return not limits or await self.backend.hit(limits, self.window)
+
+    async def reset(self, username: str) -> None:
+        await self.backend.reset(f"user:{username}")
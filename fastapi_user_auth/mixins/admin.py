@@ -3,6 +3,7 @@ from sqlalchemy.sql import Select
 from starlette.requests import Request
 
 from fastapi_user_auth.auth.schemas import SystemUserEnum
+from fastapi_user_auth.utils.casbin import load_subjects
 
 
 class AuthFieldModelAdmin(BaseAuthFieldModelAdmin):
@@ -10,6 +11,7 @@ class AuthFieldModelAdmin(BaseAuthFieldModelAdmin):
         """判断用户是否有字段权限"""
         subject = await self.site.auth.get_current_user_identity(request) or SystemUserEnum.GUEST
         action += ""
+        await load_subjects(self.site.auth.enforcer, "u:" + subject)
         effect = self.site.auth.enforcer.enforce("u:" + subject, self.unique_id, f"page:{action}:{field}", f"page:{action}")
         return effect
 
@@ -18,6 +20,7 @@ class AuthSelectModelAdmin(BaseAuthSelectModelAdmin):
     async def has_select_permission(self, request: Request, name: str) -> bool:
         """判断用户是否有数据集权限"""
         subject = await self.site.auth.get_current_user_identity(request) or SystemUserEnum.GUEST
+        await load_subjects(self.site.auth.enforcer, "u:" + subject)
         effect = self.site.auth.enforcer.enforce("u:" + subject, self.unique_id, f"page:select:{name}", "page:select")
         return effect
 
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict, namedtuple
+from typing import Any, Hashable, List, Optional, Tuple
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+MISSING = object()
+
+
+class TTLCache:
+    """Bounded LRU cache with a per-entry time to live.
+
+    Entries are evicted in least-recently-used order once `maxsize` is reached,
+    and are treated as missing once their ttl has elapsed.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()  # key -> (expire_at, value)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is not None:
+            expire_at, value = item
+            if expire_at is None or expire_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        if ttl is not None and ttl <= 0:
+            self._data.pop(key, None)
+            return
+        self._data[key] = (None if ttl is None else time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def remaining(self, key: Hashable) -> Optional[float]:
+        """Return the seconds left before `key` expires, `None` if it never expires or is missing."""
+        item = self._data.get(key)
+        if item is None or item[0] is None:
+            return None
+        return item[0] - time.monotonic()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def items(self) -> List[Tuple[Hashable, Any]]:
+        """Return a snapshot of the cached (key, value) pairs, including expired ones not yet evicted."""
+        return [(key, value) for key, (_, value) in self._data.items()]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
+
+    def __contains__(self, key: Hashable) -> bool:
+        item = self._data.get(key)
+        return item is not None and (item[0] is None or item[0] > time.monotonic())
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -7,6 +7,7 @@ from sqlalchemy.orm import Session
 
 from fastapi_user_auth.auth.models import CasbinRule
 from fastapi_user_auth.auth.schemas import SystemUserEnum
+from fastapi_user_auth.utils.enforcer import AsyncCachedEnforcer
 
 
 # 执行casbin字符串规则
@@ -15,6 +16,13 @@ def permission_enforce(enforcer: AsyncEnforcer, subject: str, permission: str) -
     return enforcer.enforce(subject, *values)
 
 
+# 懒加载模式下,执行规则之前加载主体的规则
+async def load_subjects(enforcer: AsyncEnforcer, *subjects: str) -> None:
+    """加载主体及其角色的casbin规则,只对`AsyncCachedEnforcer`的`lazy_subjects`模式生效"""
+    if isinstance(enforcer, AsyncCachedEnforcer):
+        await enforcer.load_subjects(*subjects)
+
+
 # 将casbin规则转化为字符串
 def permission_encode(*field_values: str) -> str:
     """将casbin规则转化为字符串,从v1开始"""
@@ -29,6 +37,7 @@ def permission_decode(permission: str) -> List[str]:
 
 async def get_subject_page_permissions(enforcer: AsyncEnforcer, *, subject: str, implicit: bool = False) -> List[str]:
     """根据指定subject主体获取casbin规则"""
+    await load_subjects(enforcer, subject)
     if implicit:
         permissions = await enforcer.get_implicit_permissions_for_user(subject)
         permissions = [perm for perm in permissions if perm[-2] == "page"]  # 只获取page权限
@@ -53,6 +62,7 @@ async def update_subject_page_permissions(
     permissions: List[str],
 ) -> List[str]:
     """根据指定subject主体更新casbin规则,会删除旧的规则,添加新的规则"""
+    await load_subjects(enforcer, subject)
     # 获取主体的页面权限
     old_rules = enforcer.get_filtered_policy(0, subject, "", "", "page")
     old_rules = {tuple(i) for i in old_rules}
@@ -150,6 +160,7 @@ async def update_subject_data_permissions(
     if not policy_matrix:
         return "success"
     remove_, allow_, deny_ = policy_matrix
+    await load_subjects(enforcer, subject, super_subject)
     # 删除旧的权限
     # bfc1eec773c2b331#page:list#page
     v1, v2, v3 = permission_decode(permission)
@@ -0,0 +1,311 @@
+import asyncio
+import functools
+import heapq
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from casbin import AsyncEnforcer
+from casbin.model.model import DEFAULT_DOMAIN
+from casbin.model.policy_op import PolicyOp
+from casbin.rbac.default_role_manager import RoleManager
+
+from .cache import MISSING, TTLCache
+from .sqlachemy_adapter import Filter
+
+ROOT_SUBJECT = "u:root"
+
+
+class PermissionIndex:
+    """Precomputed decisions of `auth/model.conf` for `enforce(sub, obj, act, group)`.
+
+    The p rules are grouped by subject once. On the first check of a subject, the rules of the subject
+    and its roles are merged in policy order, and the first matching rule decides each `(obj, act, group)`
+    (`subjectPriority` effect), expanding `obj` to its `g2` children. The allowed keys are stored in a frozenset.
+    `lookup` returns None when the result can not be precomputed: `u:root`, subjects with `keyMatch`
+    wildcards in their acts and role managers with custom matching functions.
+    """
+
+    def __init__(self, enforcer: AsyncEnforcer):
+        self.rules: Dict[str, List[Tuple[int, List[str]]]] = defaultdict(list)
+        for index, rule in enumerate(enforcer.get_policy()):
+            self.rules[rule[0]].append((index, rule))
+        self.g: RoleManager = enforcer.rm_map.get("g")
+        self.g2: RoleManager = enforcer.rm_map.get("g2")
+        self.enabled = all(isinstance(rm, RoleManager) and rm.matching_func is None for rm in (self.g, self.g2))
+        self.subjects: Dict[str, Optional[FrozenSet[Tuple[str, str, str]]]] = {}
+        self._objects: Dict[str, Set[str]] = {}
+
+    def lookup(self, sub: str, obj: str, act: str, group: str) -> Optional[bool]:
+        allowed = self.subjects.get(sub, MISSING)
+        if allowed is MISSING:
+            allowed = self.subjects[sub] = self.compile(sub)
+        if allowed is None:
+            return None
+        return (obj, act, group) in allowed
+
+    def compile(self, sub: str) -> Optional[FrozenSet[Tuple[str, str, str]]]:
+        if not self.enabled or sub == ROOT_SUBJECT:
+            return None
+        decisions: Dict[Tuple[str, str, str], bool] = {}
+        # 按策略顺序合并主体及其角色的规则,第一条匹配的规则决定结果
+        subjects = self._closure(self.g, sub, self.g.get_roles)
+        for _, rule in heapq.merge(*(self.rules[name] for name in subjects if name in self.rules)):
+            if len(rule) < 5 or "*" in rule[2]:  # keyMatch通配符无法预先计算
+                return None
+            _, p_obj, p_act, p_group, eft = rule[:5]
+            if eft not in ("allow", "deny"):
+                continue
+            if p_obj not in self._objects:
+                self._objects[p_obj] = self._closure(self.g2, p_obj, self.g2.get_users)
+            for obj in self._objects[p_obj]:
+                decisions.setdefault((obj, p_act, p_group), eft == "allow")
+        return frozenset(key for key, allow in decisions.items() if allow)
+
+    @staticmethod
+    def _closure(rm: RoleManager, name: str, neighbors: Callable[[str], List[str]]) -> Set[str]:
+        """`name` and the names linked to it within the hierarchy level of the role manager, as `has_link` does."""
+        names, frontier = {name}, [name]
+        for _ in range(rm.max_hierarchy_level - 1):
+            frontier = [linked for item in frontier for linked in neighbors(item) if linked not in names]
+            if not frontier:
+                break
+            names.update(frontier)
+        return names
+
+
+def _invalidates_cache(method: Callable) -> Callable:
+    @functools.wraps(method)
+    async def wrapper(self: "AsyncCachedEnforcer", *args, **kwargs) -> Any:
+        self.invalidate_cache()  # casbin在写入存储之前已修改内存中的策略
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            self.invalidate_cache()
+
+    return wrapper
+
+
+class AsyncCachedEnforcer(AsyncEnforcer):
+    """AsyncEnforcer that memoizes `enforce` decisions in a bounded LRU cache.
+
+    Every policy change made through the enforcer (add/remove/update policies, role links, load_policy)
+    increments `policy_version` and clears the cache, before and after the change.
+    Rules written to the database by other means are only seen after `load_policy()`.
+
+    With `index_policies=True` (for `auth/model.conf` only), checks are answered by a `PermissionIndex`
+    built after `load_policy()` and rebuilt on the first check after a change.
+
+    With an adapter that keeps a change log (`Adapter(change_class=CasbinRuleChange)`), `load_policy_changes()`
+    applies only the changes made since the last load, instead of reloading every rule. Ids skipped by a load
+    (changes not committed yet) are loaded again for `policy_gap_timeout` seconds, and an enforcer that did not load
+    for longer than the adapter's `change_retention` reloads every rule.
+
+    With `lazy_subjects=N`, `load_policy()` only loads the grouping rules (`g`, `g2`). The p rules of a subject
+    and its roles are loaded by `await load_subjects(subject)`, which must be called before `enforce`,
+    and the p rules of the least recently used subjects are dropped once more than N subjects are loaded.
+    """
+
+    def __init__(
+        self,
+        *args,
+        cache_maxsize: int = 100000,
+        index_policies: bool = False,
+        lazy_subjects: int = 0,
+        policy_gap_timeout: float = 10,
+        **kwargs,
+    ):
+        self.policy_version = 0
+        self.enforce_cache = TTLCache(maxsize=cache_maxsize)
+        self.index_policies = index_policies
+        self.permission_index: Optional[PermissionIndex] = None
+        self.policy_revision: Optional[int] = None  # 已加载的变更记录版本号
+        self.policy_gaps: Dict[int, float] = {}  # 版本号之前尚未提交的变更记录id -> 放弃等待的时间
+        self.policy_gap_timeout = policy_gap_timeout
+        self._policy_loaded_at = 0.0
+        self.lazy_subjects = lazy_subjects
+        # 已加载的主体 -> (策略版本, 主体及其角色)
+        self.loaded_subjects: "OrderedDict[str, Tuple[int, FrozenSet[str]]]" = OrderedDict()
+        self._resident: Dict[str, int] = {}  # 规则已加载的主体 -> 使用它的已加载主体数量
+        self._subject_levels: Optional[Dict[str, int]] = None
+        self._load_lock = asyncio.Lock()
+        super().__init__(*args, **kwargs)
+
+    def enforce(self, *rvals) -> bool:
+        if self.lazy_subjects and rvals:
+            if rvals[0] == ROOT_SUBJECT:  # root拥有全部权限,无需加载规则
+                return True
+            if rvals[0] not in self.loaded_subjects:
+                raise RuntimeError(f"The policies of {rvals[0]} are not loaded, call `await enforcer.load_subjects()` first")
+        if self.index_policies and len(rvals) == 4:
+            if self.permission_index is None:
+                self.permission_index = PermissionIndex(self)
+            result = self.permission_index.lookup(*rvals)
+            if result is not None:
+                return result
+        try:
+            result = self.enforce_cache.get(rvals, MISSING)
+        except TypeError:  # 不可哈希的参数不缓存
+            return super().enforce(*rvals)
+        if result is MISSING:
+            result = super().enforce(*rvals)
+            self.enforce_cache.set(rvals, result)
+        return result
+
+    def invalidate_cache(self) -> None:
+        self.policy_version += 1
+        self.enforce_cache.clear()
+        self.permission_index = None
+        self._subject_levels = None
+
+    async def load_policy(self):
+        get_revision = getattr(self.adapter, "get_policy_revision", None)
+        # 先读取版本号,加载期间的变更会在下次增量加载时重复应用,添加与删除都是幂等的
+        revision = await get_revision() if get_revision else None
+        if self.lazy_subjects:
+            filter_ = Filter()
+            filter_.ptype = list(self.model["g"].keys())  # 只加载角色与资源分组规则
+            await self.load_filtered_policy(filter_)
+            self.loaded_subjects.clear()
+            self._resident.clear()
+        else:
+            await self._load_policy()
+        self.policy_revision = revision
+        self.policy_gaps.clear()
+        self._policy_loaded_at = time.monotonic()
+        if self.index_policies:
+            self.permission_index = PermissionIndex(self)
+
+    async def load_policy_changes(self) -> int:
+        """Apply the changes recorded since the last load, return their number.
+        Falls back to `load_policy()` without a change log, before the first load, or after `save_policy()`."""
+        now = time.monotonic()
+        retention = getattr(self.adapter, "change_retention", None)
+        if self.policy_revision is None or (retention is not None and now - self._policy_loaded_at > retention):
+            await self.load_policy()  # 期间的变更记录可能已被删除
+            return 0
+        self._policy_loaded_at = now
+        changes = await self.adapter.load_policy_changes(self.policy_revision, list(self.policy_gaps))
+        self._update_policy_gaps([change.id for change in changes], now)
+        if not changes:
+            return 0
+        if any(change.op == "reset" for change in changes):
+            await self.load_policy()
+            return len(changes)
+        for change in changes:
+            sec, rule = change.ptype[0], change.rule
+            if self.lazy_subjects and sec == "p" and rule[0] not in self._resident:
+                continue  # 未加载的主体,使用时从数据库加载
+            variants = [rule, tuple(rule)]  # 本进程修改的规则可能以tuple保存在模型中
+            exists = any(self.model.has_policy(sec, change.ptype, variant) for variant in variants)
+            if change.op == "add":
+                changed, op = not exists and self.model.add_policy(sec, change.ptype, rule), PolicyOp.Policy_add
+            else:
+                changed, op = exists, PolicyOp.Policy_remove
+                for variant in variants:
+                    self.model.remove_policy(sec, change.ptype, variant)
+            if changed and sec == "g" and self.auto_build_role_links:
+                self.model.build_incremental_role_links(self.rm_map[change.ptype], op, sec, change.ptype, [rule])
+        self.model.sort_policies_by_subject_hierarchy()  # 新增的规则在末尾,按主体层级重新排序,用户规则优先于角色规则
+        self.invalidate_cache()
+        return len(changes)
+
+    def _update_policy_gaps(self, ids: List[int], now: float) -> None:
+        """Advances `policy_revision` to the last loaded id, waiting for the skipped ids before it."""
+        loaded = set(ids)
+        revision = max(self.policy_revision, *ids) if ids else self.policy_revision
+        for id_ in range(self.policy_revision + 1, revision):
+            if id_ not in loaded:  # 较早分配的id可能在之后才提交
+                self.policy_gaps[id_] = now + self.policy_gap_timeout
+        self.policy_gaps = {id_: until for id_, until in self.policy_gaps.items() if id_ not in loaded and until > now}
+        self.policy_revision = revision
+
+    def clear_policy(self):
+        super().clear_policy()
+        self.invalidate_cache()
+
+    def build_role_links(self):
+        super().build_role_links()
+        self.invalidate_cache()
+
+    _load_policy = _invalidates_cache(AsyncEnforcer.load_policy)
+    load_filtered_policy = _invalidates_cache(AsyncEnforcer.load_filtered_policy)
+    load_increment_filtered_policy = _invalidates_cache(AsyncEnforcer.load_increment_filtered_policy)
+    _add_policy = _invalidates_cache(AsyncEnforcer._add_policy)
+    _add_policies = _invalidates_cache(AsyncEnforcer._add_policies)
+    _update_policy = _invalidates_cache(AsyncEnforcer._update_policy)
+    _update_policies = _invalidates_cache(AsyncEnforcer._update_policies)
+    _update_filtered_policies = _invalidates_cache(AsyncEnforcer._update_filtered_policies)
+    _remove_policy = _invalidates_cache(AsyncEnforcer._remove_policy)
+    _remove_policies = _invalidates_cache(AsyncEnforcer._remove_policies)
+    _remove_filtered_policy = _invalidates_cache(AsyncEnforcer._remove_filtered_policy)
+    _remove_filtered_policy_returns_effects = _invalidates_cache(AsyncEnforcer._remove_filtered_policy_returns_effects)
+
+    async def load_subjects(self, *subjects: str) -> None:
+        """Load the p rules of `subjects` and of their roles, with `lazy_subjects` only."""
+        if not self.lazy_subjects or all(self._is_loaded(subject) for subject in subjects):
+            return
+        async with self._load_lock:
+            load, drop = set(), set()
+            for subject in subjects:
+                if self._is_loaded(subject):
+                    continue
+                # 角色变更后重新计算主体的角色
+                _, old = self.loaded_subjects.pop(subject, (None, frozenset()))
+                new = frozenset(PermissionIndex._closure(self.rm_map["g"], subject, self.rm_map["g"].get_roles))
+                self.loaded_subjects[subject] = (self.policy_version, new)
+                load |= self._acquire(new - old)
+                drop |= self._release(old - new)
+            while len(self.loaded_subjects) > self.lazy_subjects:
+                _, (_, names) = self.loaded_subjects.popitem(last=False)
+                drop |= self._release(names)
+            drop -= load
+            if load or drop:
+                self._drop_rules(drop | load)  # 同时移除未被记录的残留规则,避免重复加载
+            if load:
+                filter_ = Filter()
+                filter_.ptype, filter_.v0 = ["p"], sorted(load)
+                await self.adapter.load_filtered_policy(self.model, filter_)
+                self._sort_rules()
+            self.permission_index = None
+
+    def _is_loaded(self, subject: str) -> bool:
+        if subject == ROOT_SUBJECT:
+            return True
+        entry = self.loaded_subjects.get(subject)
+        if entry is None or entry[0] != self.policy_version:
+            return False
+        self.loaded_subjects.move_to_end(subject)
+        return True
+
+    def _acquire(self, names: Iterable[str]) -> Set[str]:
+        """Count a loaded subject using `names`, return the names whose rules need loading."""
+        new = set()
+        for name in names:
+            self._resident[name] = self._resident.get(name, 0) + 1
+            if self._resident[name] == 1:
+                new.add(name)
+        return new
+
+    def _release(self, names: Iterable[str]) -> Set[str]:
+        """Uncount a loaded subject using `names`, return the names whose rules are no longer used."""
+        unused = set()
+        for name in names:
+            self._resident[name] -= 1
+            if self._resident[name] <= 0:
+                del self._resident[name]
+                unused.add(name)
+        return unused
+
+    def _drop_rules(self, names: Set[str]) -> None:
+        assertion = self.model["p"]["p"]
+        assertion.policy = [rule for rule in assertion.policy if rule[0] not in names]
+
+    def _sort_rules(self) -> None:
+        """Sort the p rules by subject hierarchy as `load_policy` does, users before their roles."""
+        if self._subject_levels is None:
+            self._subject_levels = self.model.get_subject_hierarchy_map(self.model["g"]["g"].policy)
+        levels, prefix = self._subject_levels, self.model.get_name_with_domain(DEFAULT_DOMAIN, "")
+        assertion = self.model["p"]["p"]
+        assertion.policy.sort(key=lambda rule: levels.get(prefix + rule[0], 0))
+        assertion.policy_map = {",".join(rule): i for i, rule in enumerate(assertion.policy)}
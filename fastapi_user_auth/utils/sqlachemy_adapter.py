@@ -1,8 +1,9 @@
-from typing import Any, Iterable, List, Optional, Tuple, Union
+from datetime import datetime, timedelta
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
 
 from casbin import Model, persist
 from casbin.persist.adapters.asyncio import AsyncAdapter, AsyncUpdateAdapter
-from sqlalchemy import Column, Integer, String, and_, delete, insert, or_, select
+from sqlalchemy import Column, Integer, String, and_, delete, func, insert, or_, select
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import Select
 from sqlalchemy.sql.dml import Delete
@@ -65,7 +66,12 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
         db: Union[Database, AsyncDatabase],
         db_class: Optional[Any] = None,
         filtered: bool = False,
+        change_class: Optional[Any] = None,
+        change_retention: Optional[float] = 7 * 24 * 3600,
     ):
+        """`change_class`: the change log model, e.g. `CasbinRuleChange`. When set, every change is
+        also recorded in it, in the same transaction, so enforcers can load only the changes since their revision.
+        Entries older than `change_retention` seconds are deleted on each change, None keeps them."""
         self.db = db
         if db_class is None:
             db_class = DefaultCasbinRule
@@ -85,6 +91,60 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
 
         self._db_class = db_class
         self._filtered: bool = filtered
+        self._change_class = change_class
+        self.change_retention = change_retention
+
+    @staticmethod
+    def _line_rule(line) -> List[str]:
+        rule = []
+        for v in (line.v0, line.v1, line.v2, line.v3, line.v4, line.v5):
+            if v is None:
+                break
+            rule.append(v)
+        return rule
+
+    async def _log_changes(self, op: str, changes: Iterable[Tuple[str, Sequence[str]]]) -> None:
+        """records (ptype, rule) changes in the change log, without committing."""
+        if self._change_class is None:
+            return
+        values = [
+            self._change_class(op=op, ptype=ptype, **{f"v{i}": v for i, v in enumerate(rule)}).dict(exclude={"id"})
+            for ptype, rule in changes
+        ]
+        if not values:
+            return
+        await self.db.async_execute(insert(self._change_class).values(values))
+        if self.change_retention is not None and hasattr(self._change_class, "create_time"):
+            expired = datetime.now() - timedelta(seconds=self.change_retention)
+            await self.db.async_execute(delete(self._change_class).where(self._change_class.create_time < expired))
+
+    async def _delete(self, query: Delete) -> int:
+        """executes a delete query, logging the deleted rules."""
+        if self._change_class is not None:
+            lines = await self.db.async_scalars(select(self._db_class).where(query.whereclause))
+            await self._log_changes("remove", [(line.ptype, self._line_rule(line)) for line in lines])
+        return (await self.db.async_execute(query)).rowcount  # type: ignore
+
+    async def get_policy_revision(self) -> Optional[int]:
+        """returns the id of the last change log entry, or None without a change log."""
+        if self._change_class is None:
+            return None
+        return await self.db.async_scalar(select(func.coalesce(func.max(self._change_class.id), 0)))
+
+    async def load_policy_changes(self, revision: int, missing: Iterable[int] = ()) -> List[Any]:
+        """returns the change log entries after `revision`, in order.
+        `missing`: ids below `revision` that were not committed yet when it was read, they are loaded again."""
+        condition = self._change_class.id > revision
+        missing = list(missing)
+        if missing:
+            condition = or_(condition, self._change_class.id.in_(missing))
+        query = select(self._change_class).where(condition).order_by(self._change_class.id)
+        return (await self.db.async_scalars(query)).all()
+
+    async def prune_policy_changes(self, revision: int) -> None:
+        """deletes the change log entries up to `revision`, they are no longer needed once every enforcer passed it."""
+        await self.db.async_execute(delete(self._change_class).where(self._change_class.id <= revision))
+        await self.db.async_commit()
 
     async def load_policy(self, model: Model) -> None:
         """loads all policy rules from the storage."""
@@ -133,6 +193,7 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
                     values.append(self.parse_rule(ptype, rule).dict())
         if values:
             await self.db.async_execute(insert(self._db_class).values(values))
+        await self._log_changes("reset", [("", [])])  # 全量替换,其他进程需要重新加载全部规则
         await self.db.async_commit()
         return True
 
@@ -140,16 +201,19 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
         """adds a policy rule to the storage."""
         obj = self.parse_rule(ptype, rule)
         self.db.add(obj)
+        await self._log_changes("add", [(ptype, rule)])
         await self.db.async_commit()
 
     async def add_policies(self, sec: str, ptype: str, rules: Iterable[Tuple[str]]) -> None:
         """adds a policy rules to the storage."""
+        rules = list(rules)  # 可能是生成器,需要遍历两次
         values = []
         for rule in rules:
             values.append(self.parse_rule(ptype, rule).dict())
         if not values:
             return
         await self.db.async_execute(insert(self._db_class).values(values))
+        await self._log_changes("add", [(ptype, rule) for rule in rules])
         await self.db.async_commit()
 
     # pylint: disable=unused-argument
@@ -162,7 +226,7 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
             if not v:
                 continue
             query = query.filter(getattr(self._db_class, f"v{i}") == v)
-        res = (await self.db.async_execute(query)).rowcount  # type: ignore
+        res = await self._delete(query)
         await self.db.async_commit()
         return res > 0  # pragma: no cover
 
@@ -179,7 +243,7 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
         for rule in rules:
             _rules.append(and_(*(getattr(self._db_class, f"v{i}") == v for i, v in enumerate(rule) if v)))
         query = query.filter(or_(*_rules))
-        await self.db.async_execute(query)
+        await self._delete(query)
         await self.db.async_commit()
 
     async def remove_filtered_policy(self, sec: str, ptype: str, field_index: int, *field_values: Tuple[str]) -> bool:
@@ -198,7 +262,7 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
             if v != "":
                 v_value = getattr(self._db_class, f"v{field_index + i}")
                 query = query.filter(v_value == v)
-        res = (await self.db.async_execute(query)).rowcount  # type: ignore
+        res = await self._delete(query)
         await self.db.async_commit()
         return res > 0
 
@@ -223,6 +287,8 @@ class Adapter(AsyncAdapter, AsyncUpdateAdapter):
         # need the length of the longest_rule to perform overwrite
         longest_rule = old_rule if len(old_rule) > len(new_rule) else new_rule
         old_rule_line = await self.db.async_scalar(query)
+        await self._log_changes("remove", [(ptype, self._line_rule(old_rule_line))])
+        await self._log_changes("add", [(ptype, new_rule)])
         # overwrite the old rule with the new rule
         for index in range(len(longest_rule)):
             if index < len(new_rule):
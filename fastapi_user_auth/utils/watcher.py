@@ -0,0 +1,136 @@
+import asyncio
+import contextlib
+import logging
+import uuid
+from typing import Callable, Dict, Optional
+
+from casbin import AsyncEnforcer
+from casbin.persist.watcher import Watcher
+
+from .enforcer import AsyncCachedEnforcer
+
+logger = logging.getLogger(__name__)
+
+
+class PolicyWatcher(Watcher):
+    """Keep the enforcers of several workers in sync.
+
+    With `redis`, every policy change made through the enforcer is published on `channel`, and the other
+    workers reload when they receive it. Without it, every worker polls the revision of the adapter's change log
+    every `poll_interval` seconds. Changes and notifications are debounced for `debounce` seconds,
+    so a bulk edit causes one reload, which only applies the new changes with an `AsyncCachedEnforcer`.
+    Call `start()` on startup and `close()` on shutdown.
+    """
+
+    def __init__(
+        self,
+        enforcer: AsyncEnforcer,
+        *,
+        redis=None,
+        channel: str = "auth:casbin:policy",
+        poll_interval: float = 5,
+        debounce: float = 0.5,
+    ):
+        assert redis is not None or isinstance(
+            enforcer, AsyncCachedEnforcer
+        ), "polling requires an AsyncCachedEnforcer whose adapter keeps a change log"
+        self.enforcer = enforcer
+        self.redis = redis
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.reloads = 0
+        self._id = uuid.uuid4().hex  # 忽略本进程发布的通知
+        self._callback: Optional[Callable] = None
+        self._lock = asyncio.Lock()
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._listener: Optional[asyncio.Task] = None
+        enforcer.set_watcher(self)
+
+    def set_update_callback(self, func: Callable):
+        """`func` is called after each reload."""
+        self._callback = func
+
+    def update(self):
+        """Called by the enforcer after a policy change."""
+        if self.redis is not None:
+            self._schedule("publish", self._publish)
+
+    async def start(self) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen() if self.redis is not None else self._poll())
+
+    async def close(self) -> None:
+        tasks = [task for task in [self._listener, *self._tasks.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._listener = None
+        self._tasks.clear()
+
+    def _schedule(self, name: str, func: Callable) -> None:
+        """Run `func` once, `debounce` seconds after the first of a burst of calls."""
+        task = self._tasks.get(name)
+        if task is None or task.done():
+            self._tasks[name] = asyncio.create_task(self._debounced(name, func))
+
+    async def _debounced(self, name: str, func: Callable) -> None:
+        await asyncio.sleep(self.debounce)
+        self._tasks.pop(name, None)  # 执行期间的新通知会再次调度
+        try:
+            await func()
+        except Exception:
+            logger.exception("Policy watcher failed to %s", name)
+
+    async def _publish(self) -> None:
+        await self.redis.publish(self.channel, self._id)
+
+    def _session(self):
+        """The database session of the adapter, if it has one."""
+        db = getattr(self.enforcer.adapter, "db", None)
+        return db() if callable(db) else contextlib.nullcontext()
+
+    async def reload(self) -> None:
+        """Apply the changes made by other workers."""
+        async with self._lock:
+            async with self._session():
+                if isinstance(self.enforcer, AsyncCachedEnforcer):
+                    await self.enforcer.load_policy_changes()
+                else:
+                    await self.enforcer.load_policy()
+            self.reloads += 1
+        if self._callback is not None:
+            result = self._callback()
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for message in pubsub.listen():
+                        data = message.get("data")
+                        if message.get("type") == "message" and data not in (self._id, self._id.encode()):
+                            self._schedule("reload", self.reload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:  # 连接断开后重新订阅,期间的修改通过重新加载补齐
+                logger.exception("Policy watcher lost the redis subscription")
+                await asyncio.sleep(self.poll_interval)
+                self._schedule("reload", self.reload)
+
+    async def _poll(self) -> None:
+        adapter = self.enforcer.adapter
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                async with self._session():
+                    revision = await adapter.get_policy_revision()
+            except Exception:
+                logger.exception("Policy watcher failed to read the policy revision")
+                continue
+            if revision != self.enforcer.policy_revision or self.enforcer.policy_gaps:  # 等待未提交的变更记录
+                self._schedule("reload", self.reload)
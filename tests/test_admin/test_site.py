@@ -0,0 +1,35 @@
+import asyncio
+
+from fastapi_amis_admin.admin import Settings
+from starlette.requests import Request
+
+from fastapi_user_auth.admin import AuthAdminSite
+from fastapi_user_auth.auth import Auth
+from fastapi_user_auth.auth.backends.memory import MemoryTokenStore
+from fastapi_user_auth.auth.models import User
+
+
+async def test_user_admin_update_items(db):
+    auth = Auth(db=db, token_store=MemoryTokenStore(), user_cache_ttl=60)
+    site = AuthAdminSite(settings=Settings(site_path=""), engine=db, auth=auth)
+    user_admin = site.get_admin_or_create(site.UserAuthApp).get_admin_or_create(site.UserAuthApp.UserAdmin)
+    user = await auth.create_role_user("editor")
+    await db.async_refresh(user)
+    user_id = user.id
+    token = await auth.backend.token_store.write_token({"id": user_id, "username": "editor"})
+    assert (await auth.get_user(user_id)).nickname == ""
+    request = Request({"type": "http", "headers": [], "auth": auth})
+    # item_id为字符串,缓存与token以主键的实际类型保存
+    await user_admin.update_items(request, [str(user_id)], {"nickname": "changed"})
+    assert (await auth.get_user(user_id)).nickname == "changed"
+
+    async def read_nickname():  # 其他请求的会话
+        async with db():
+            return (await db.async_get(User, user_id)).nickname
+
+    # 清除缓存前已提交,其他请求不会重新缓存旧数据
+    assert await asyncio.create_task(read_nickname()) == "changed"
+    assert await auth.backend.token_store.read_token(token) is not None
+    await user_admin.update_items(request, [str(user_id)], {"is_active": False})
+    assert await auth.backend.token_store.read_token(token) is None
+    await db.async_commit()
@@ -1,4 +1,14 @@
+import pytest
+from starlette.requests import Request
+from starlette.responses import Response
+
 from fastapi_user_auth.auth import Auth
+from fastapi_user_auth.auth.backends.db import DbRevocationStore, DbTokenStore
+from fastapi_user_auth.auth.backends.jwt import JwtTokenStore
+from fastapi_user_auth.auth.backends.memory import MemoryTokenStore
+from fastapi_user_auth.auth.backends.redis import RedisTokenStore
+from fastapi_user_auth.auth.schemas import BaseTokenData, UserSnapshotTokenData
+from fastapi_user_auth.auth.throttle import LoginThrottle
 
 
 async def test_create_role_user(auth: Auth):
@@ -10,6 +20,131 @@ async def test_create_role_user(auth: Auth):
     assert result
 
 
+async def test_has_role_for_user_implicit(auth: Auth):
+    await auth.enforcer.add_role_for_user("u:alice", "r:editor")
+    await auth.enforcer.add_role_for_user("r:editor", "r:viewer")
+    assert await auth.has_role_for_user("alice", "viewer")
+    assert await auth.has_role_for_user("alice", ["editor", "viewer"], is_any=False)
+    assert not await auth.has_role_for_user("alice", ["editor", "admin"], is_any=False)
+    assert not await auth.has_role_for_user("alice", "admin")
+    # resolved once per request
+    request = Request({"type": "http", "headers": [], "user_token_info": BaseTokenData(id=1, username="alice")})
+    assert await auth.get_current_user_roles(request) == {"editor", "viewer"}
+    assert request.scope["user_roles"] == {"editor", "viewer"}
+    assert await auth.has_role(request, roles=["admin", "viewer"])
+
+
+async def test_user_cache(db):
+    auth = Auth(db=db, user_cache_ttl=60)
+    user = await auth.create_role_user("admin3")
+    await auth.db.async_refresh(user)
+    user_id = user.id
+    assert (await auth.get_user(user_id)).nickname == ""
+    user.nickname = "changed"
+    await auth.db.async_commit()
+    # cached
+    cached = await auth.get_user(user_id)
+    assert cached.nickname == ""
+    assert cached.username == "admin3"
+    assert auth.user_cache.info().hits == 1
+    # invalidate
+    await auth.invalidate_user(user_id)
+    assert (await auth.get_user(user_id)).nickname == "changed"
+
+
+async def test_user_snapshot(db):
+    auth = Auth(db=db, token_store=MemoryTokenStore(TokenDataSchema=UserSnapshotTokenData), user_snapshot=True)
+    # the user does not exist in the database, it is built from the token
+    token = await auth.backend.token_store.write_token({"id": 100, "username": "snapshot", "nickname": "nick"})
+
+    def make_request():
+        return Request({"type": "http", "headers": [(b"authorization", f"bearer {token}".encode())]})
+
+    user = await auth.get_current_user(make_request())
+    assert user.id == 100
+    assert user.nickname == "nick"
+    assert user.password is None
+    # outdated snapshot
+    await auth.invalidate_user(100)
+    assert await auth.get_current_user(make_request()) is None
+
+
+@pytest.mark.parametrize("store", ["redis", "db", "jwt"])
+async def test_user_snapshot_shared_version(db, store):
+    from fakeredis import FakeAsyncRedis
+
+    redis = FakeAsyncRedis()
+
+    def make_auth():
+        if store == "redis":
+            token_store = RedisTokenStore(redis, TokenDataSchema=UserSnapshotTokenData)
+        elif store == "jwt":  # 通过共享的撤销列表注销token
+            token_store = JwtTokenStore(
+                "secret",
+                TokenDataSchema=UserSnapshotTokenData,
+                revocation_store=DbRevocationStore(db),
+                revocation_sync_interval=0,
+            )
+        else:
+            token_store = DbTokenStore(db, TokenDataSchema=UserSnapshotTokenData)
+        return Auth(db=db, token_store=token_store, user_snapshot=True)
+
+    # 两个进程共享同一个token存储
+    auth1, auth2 = make_auth(), make_auth()
+    token = await auth1.backend.token_store.write_token({"id": 100, "username": "snapshot", "auth_version": 0})
+    await db.async_commit()
+
+    def make_request():
+        return Request({"type": "http", "headers": [(b"authorization", f"bearer {token}".encode())]})
+
+    try:
+        assert (await auth2.get_current_user(make_request())).username == "snapshot"
+        await auth1.invalidate_user(100)
+        await db.async_commit()
+        # 其他进程以及重启后的进程都会忽略旧的快照
+        assert await auth2.get_current_user(make_request()) is None
+        assert await make_auth().get_current_user(make_request()) is None
+        if store != "jwt":
+            assert await auth2.backend.token_store.get_user_version(100) == 1
+    finally:
+        await redis.aclose()
+
+
+async def test_bypass_paths(db):
+    auth = Auth(db=db, token_store=MemoryTokenStore(), bypass_paths=["/static", "/health*", "*.js"])
+    token = await auth.backend.token_store.write_token({"id": 1, "username": "admin"})
+    cases = [
+        ("/static/a.css", True),
+        ("/static", True),
+        ("/staticfiles/a.css", False),  # 前缀只匹配完整的路径段
+        ("/healthz", True),
+        ("/admin/app.js", True),
+        ("/admin", False),
+    ]
+    for path, bypassed in cases:
+        assert auth.backend.is_bypassed(path) is bypassed
+        request = Request({"type": "http", "path": path, "headers": [(b"authorization", f"bearer {token}".encode())]})
+        await auth.get_current_user(request)
+        assert (request.scope["user_token_info"] is None) is bypassed
+
+
+async def test_login_throttle_spoofed_headers(db):
+    throttle = LoginThrottle(username_limit=0, ip_limit=1, window=60, trusted_proxies=["10.0.0.1"])
+    auth = Auth(db=db, login_throttle=throttle)
+    assert await throttle.allow("admin", "10.0.0.1", "203.0.113.7")
+    for header in [b"x-client-ip", b"remote-host", b"x-real-ip"]:
+        request = Request(
+            {
+                "type": "http",
+                "client": ("10.0.0.1", 1234),
+                "headers": [(b"x-forwarded-for", b"203.0.113.7"), (header, b"1.2.3.4")],
+            }
+        )
+        # 客户端设置的其他代理请求头不影响限流的ip
+        result = await auth.request_login(request, Response(), "admin", "admin")
+        assert result.status == -3
+
+
 async def test_authenticate_user(fake_auth: Auth):
     # error
     user = await fake_auth.authenticate_user("admin", "admin1")
@@ -2,6 +2,7 @@ import pytest
 from fastapi import Depends, FastAPI, HTTPException
 from starlette.requests import Request
 
+from fastapi_user_auth.auth.middleware import USER_PENDING
 from tests.test_auth.conftest import UserClient
 
 
@@ -19,6 +20,10 @@ def setup(logins: UserClient):
     subapp3 = FastAPI(dependencies=[Depends(auth.requires("admin")())])
     app.mount("/subapp3", subapp3)
 
+    subapp4 = FastAPI()
+    app.mount("/subapp4", subapp4)
+    auth.backend.attach_middleware(subapp4, lazy=True)
+
     # auth decorator
     @subapp1.get("/auth/user")
     @auth.requires()
@@ -36,10 +41,24 @@ def setup(logins: UserClient):
     def user_3(request: Request):
         return request.user
 
+    @subapp2.get("/auth/user_async")
+    async def user_async(request: Request):
+        if request.user and bool(request.scope.get("user")):
+            return request.user
+        raise HTTPException(status_code=403)
+
+    @subapp4.get("/auth/lazy")
+    async def lazy(request: Request):
+        # 加载之前request.user为None,读取它不会出错
+        pending = request.scope.get(USER_PENDING, False) and not request.user and "user_token_info" not in request.scope
+        user = await request.auth.get_current_user(request)
+        return {"pending": pending, "username": user.username if user else None, "resolved": request.user is user}
+
 
 path_admin_auth = {
     "/subapp1/auth/user",
     "/subapp2/auth/user",
+    "/subapp2/auth/user_async",
     "/subapp3/auth/user",
 }
 
@@ -51,3 +70,9 @@ def test_admin_auth(logins: UserClient, path):
     data = response.json()
     assert data["id"] == logins.user.id
     assert data["username"] == logins.user.username
+
+
+@pytest.mark.parametrize("logins", ["admin"], indirect=True)
+def test_lazy_middleware(logins: UserClient):
+    data = logins.client.get("/subapp4/auth/lazy").json()
+    assert data == {"pending": True, "username": logins.user.username, "resolved": True}
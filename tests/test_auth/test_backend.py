@@ -1,20 +1,102 @@
+import asyncio
+import hashlib
+import time
+
 import pytest
+import rsa
+from fakeredis import FakeAsyncRedis
+from sqlalchemy import func, select
 
-from fastapi_user_auth.auth.backends.db import DbTokenStore
+from fastapi_user_auth.auth.backends.cache import CachingTokenStore
+from fastapi_user_auth.auth.backends.codec import MsgpackTokenCodec, OrjsonTokenCodec
+from fastapi_user_auth.auth.backends.db import DbRevocationStore, DbTokenStore, TokenRevokedModel
 from fastapi_user_auth.auth.backends.jwt import JwtTokenStore
+from fastapi_user_auth.auth.backends.memory import MemoryTokenStore
+from fastapi_user_auth.auth.backends.redis import RedisRevocationStore, RedisTokenStore
+from fastapi_user_auth.auth.backends.tiered import TieredTokenStore
 from fastapi_user_auth.auth.schemas import BaseTokenData
 
 token_data = BaseTokenData(id=1, username="test")
 
 
+class UUIDTokenData(BaseTokenData):
+    id: str
+
+
 async def test_jwt_token_store():
     store = JwtTokenStore(secret_key="09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7")
     token = await store.write_token(token_data)
     assert token
     data = await store.read_token(token=token)
     assert data == token_data
-    with pytest.raises(NotImplementedError):
-        await store.destroy_token(token)
+    await store.destroy_token(token)
+    assert await store.read_token(token=token) is None
+
+
+async def test_jwt_token_store_revocation_store(db):
+    secret_key = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
+    store1 = JwtTokenStore(secret_key=secret_key, revocation_store=DbRevocationStore(db))
+    store2 = JwtTokenStore(secret_key=secret_key, revocation_store=DbRevocationStore(db), revocation_sync_interval=0)
+    token = await store1.write_token(token_data)
+    assert await store2.read_token(token=token) == token_data
+    await store1.destroy_token(token)
+    assert await store1.read_token(token=token) is None
+    # 其他进程增量同步撤销列表
+    assert await store2.read_token(token=token) is None
+
+
+async def test_jwt_token_store_revocation_prune(db):
+    revocation_store = DbRevocationStore(db)
+    store = JwtTokenStore(secret_key="secret", revocation_store=revocation_store, revocation_prune_interval=60)
+
+    async def count_revoked() -> int:
+        async with db():
+            return await db.async_scalar(select(func.count(TokenRevokedModel.id)))
+
+    await revocation_store.add("expired", int(time.time()) - 10)
+    await revocation_store.add("live", int(time.time()) + 60)
+    # 启动后第一次同步时删除已过期的记录
+    await store.sync_revocations()
+    assert await count_revoked() == 1
+    # 每revocation_prune_interval秒清理一次
+    await revocation_store.add("expired2", int(time.time()) - 10)
+    await store.sync_revocations()
+    assert await count_revoked() == 2
+    store._next_prune = 0
+    await store.sync_revocations()
+    assert await count_revoked() == 1
+
+
+async def test_redis_revocation_store_delete_expired(redis):
+    revocation_store = RedisRevocationStore(redis)
+    await revocation_store.add("expired", int(time.time()) - 10)
+    await revocation_store.add("live", int(time.time()) + 60)
+    await revocation_store.delete_expired()
+    assert await redis.zcard(revocation_store.key) == 1
+
+
+async def test_jwt_token_store_rs256():
+    _, private_key = rsa.newkeys(1024)
+    store = JwtTokenStore(secret_key=private_key.save_pkcs1().decode(), algorithm="RS256")
+    token = await store.write_token(token_data)
+    assert await store.read_token(token=token) == token_data
+    assert await store.read_token(token=token) == token_data
+    assert store.cache.info().hits == 1
+    assert await store.read_token(token=token[:-4] + "abcd") is None
+
+
+async def test_jwt_token_store_cache_expire():
+    store = JwtTokenStore(secret_key="secret", expire_seconds=-10)
+    token = await store.write_token(token_data)
+    assert await store.read_token(token=token) is None
+    store = JwtTokenStore(secret_key="secret")
+    token = await store.write_token(token_data)
+    assert await store.read_token(token=token) == token_data
+    # 缓存命中时仍然检查过期时间
+    key = hashlib.sha256(token.encode()).digest()
+    exp, jti, iat, data = store.cache.get(key)
+    store.cache.set(key, (int(time.time()) - 1, jti, iat, data))
+    assert await store.read_token(token=token) is None
 
 
 async def test_db_token_store(db):
@@ -30,5 +112,253 @@ async def test_db_token_store(db):
     assert data is None
 
 
-async def test_redis_token_store():
-    pass
+async def test_caching_token_store(db):
+    store = CachingTokenStore(DbTokenStore(db), maxsize=2)
+    token = await store.write_token(token_data)
+    await db.async_commit()
+    assert await store.read_token(token=token) == token_data
+    assert store.cache_info().hits == 1
+    # 未知token使用负缓存
+    assert await store.read_token(token="unknown") is None
+    assert await store.read_token(token="unknown") is None
+    assert store.cache_info().misses == 1
+    await store.destroy_token(token=token)
+    await db.async_commit()
+    assert await store.read_token(token=token) is None
+    assert await store.store.read_token(token=token) is None
+
+
+async def test_caching_token_store_ttl():
+    store = CachingTokenStore(MemoryTokenStore(), ttl=0.05)
+    token = await store.write_token(token_data)
+    assert await store.read_token(token=token) == token_data
+    await asyncio.sleep(0.06)
+    # 缓存过期后重新读取
+    assert await store.read_token(token=token) == token_data
+    assert store.cache_info().misses == 1
+    assert store.cache.remaining(token) <= 0.05
+
+
+async def test_caching_token_store_token_expire(db):
+    # 缓存时间不超过token的剩余有效期
+    memory = MemoryTokenStore()
+    store = CachingTokenStore(memory, ttl=60)
+    await memory.save_token("token", token_data)
+    memory.cache.set("token", token_data, ttl=0.05)
+    assert await store.read_token(token="token") == token_data
+    assert store.cache.remaining("token") <= 0.05
+    await asyncio.sleep(0.06)
+    assert await memory.read_token(token="token") is None
+    assert await store.read_token(token="token") is None
+    for backend in [JwtTokenStore(secret_key="secret", expire_seconds=2), DbTokenStore(db, expire_seconds=2)]:
+        store = CachingTokenStore(backend, ttl=60)
+        token = await backend.write_token(token_data)
+        await db.async_commit()
+        assert await store.read_token(token=token) == token_data
+        assert 0 < store.cache.remaining(token) <= 3
+
+
+@pytest.fixture
+async def redis():
+    client = FakeAsyncRedis()
+    yield client
+    await client.flushall()
+    await client.aclose()
+
+
+async def test_redis_token_store(redis):
+    store = RedisTokenStore(redis)
+    token = await store.write_token(token_data)
+    assert token
+    data = await store.read_token(token=token)
+    assert data == token_data
+    await store.destroy_token(token=token)
+    data = await store.read_token(token=token)
+    assert data is None
+
+
+async def test_redis_token_store_read_token_with_ttl(redis):
+    store = RedisTokenStore(redis, expire_seconds=100)
+    token = await store.write_token(token_data)
+    data, ttl = await store.read_token_with_ttl(token)
+    assert data == token_data and 0 < ttl <= 100
+    assert await store.read_token_with_ttl("unknown") == (None, None)
+    store = CachingTokenStore(store, ttl=60)
+    await redis.expire(store.store.get_key(token), 1)
+    assert await store.read_token(token=token) == token_data
+    assert store.cache.remaining(token) <= 1
+
+
+async def test_redis_token_store_sliding_expiration(redis):
+    store = RedisTokenStore(redis, expire_seconds=100, sliding_expiration=True)
+    token = await store.write_token(token_data)
+    await redis.expire(store.get_key(token), 10)
+    assert await store.read_token(token=token) == token_data
+    assert await redis.ttl(store.get_key(token)) > 10
+    # 用户索引比token多保留一个刷新周期,读取时续期
+    user_key = store.get_user_key(token_data.id)
+    assert 100 < await redis.ttl(user_key) <= 151
+    await redis.expire(user_key, 10)
+    store._index_refresh.clear()
+    assert await store.read_token(token=token) == token_data
+    assert await redis.ttl(user_key) > 100
+
+
+async def test_redis_token_store_bulk(redis):
+    store = RedisTokenStore(redis)
+    tokens = [await store.write_token(token_data) for _ in range(3)]
+    other = await store.write_token(BaseTokenData(id=2, username="other"))
+    assert await store.read_tokens([*tokens, "unknown"]) == [token_data, token_data, token_data, None]
+    await store.destroy_tokens(tokens[:1])
+    assert set(await store.list_user_tokens(token_data.id)) == set(tokens[1:])
+    await store.destroy_user_tokens(token_data.id)
+    assert await store.read_tokens(tokens) == [None, None, None]
+    assert await store.list_user_tokens(token_data.id) == []
+    assert not await redis.exists(store.get_user_key(token_data.id))
+    assert await store.read_token(token=other)
+
+
+async def test_db_token_store_expire(db):
+    store = DbTokenStore(db, expire_seconds=-1)
+    token = await store.write_token(token_data)
+    await db.async_commit()
+    assert await store.read_token(token=token) is None
+    assert await store.delete_expired_tokens(batch_size=1) == 1
+    assert await store.delete_expired_tokens() == 0
+
+
+async def test_db_token_store_batch_write(db):
+    store = DbTokenStore(db, batch_write=True, batch_max_size=3)
+    tokens = await asyncio.gather(*[store.write_token(BaseTokenData(id=i, username=f"user{i}")) for i in range(5)])
+    assert len(set(tokens)) == 5
+    for i, token in enumerate(tokens):
+        data = await store.read_token(token=token)
+        assert data.id == i
+
+
+async def test_db_token_store_user_tokens(db):
+    store = DbTokenStore(db)
+    tokens = [await store.write_token(token_data) for _ in range(2)]
+    other = await store.write_token(BaseTokenData(id=2, username="other"))
+    await db.async_commit()
+    assert set(await store.list_user_tokens(token_data.id)) == set(tokens)
+    await store.destroy_user_tokens(token_data.id)
+    await db.async_commit()
+    assert await store.list_user_tokens(token_data.id) == []
+    assert await store.read_token(token=tokens[0]) is None
+    assert await store.read_token(token=other)
+    # 非整数主键
+    store = DbTokenStore(db, TokenDataSchema=UUIDTokenData)
+    uuid_data = UUIDTokenData(id="2f1c7a4e-5b0d-4f6e-9a37-0d5c1b8e6f21", username="uuid")
+    token = await store.write_token(uuid_data)
+    await db.async_commit()
+    assert await store.list_user_tokens(uuid_data.id) == [token]
+    await store.destroy_user_tokens(uuid_data.id)
+    await db.async_commit()
+    assert await store.read_token(token=token) is None
+
+
+async def test_jwt_token_store_user_tokens(db):
+    secret_key = "09d25e094faa6ca2556c818166b7a9563b93f7099f6f0f4caa6cf63b88e8d3e7"
+    store1 = JwtTokenStore(secret_key=secret_key, revocation_store=DbRevocationStore(db))
+    store2 = JwtTokenStore(secret_key=secret_key, revocation_store=DbRevocationStore(db), revocation_sync_interval=0)
+    token = await store1.write_token(token_data)
+    other = await store1.write_token(BaseTokenData(id=2, username="other"))
+    assert await store2.read_token(token=token) == token_data
+    await store1.destroy_user_tokens(token_data.id)
+    assert await store1.read_token(token=token) is None
+    assert await store2.read_token(token=token) is None
+    assert await store2.read_token(token=other)
+    # 注销之后签发的token有效
+    token = await store1.write_token(token_data)
+    assert await store2.read_token(token=token) == token_data
+    # 非整数主键
+    store1.TokenDataSchema = store2.TokenDataSchema = UUIDTokenData
+    uuid_data = UUIDTokenData(id="tenant:2f1c7a4e-5b0d-4f6e-9a37-0d5c1b8e6f21", username="uuid")
+    token = await store1.write_token(uuid_data)
+    assert await store2.read_token(token=token) == uuid_data
+    await store1.destroy_user_tokens(uuid_data.id)
+    assert await store2.read_token(token=token) is None
+    assert uuid_data.id in store2.not_before
+
+
+async def test_db_token_store_codec(db):
+    json_store = DbTokenStore(db)
+    orjson_store = DbTokenStore(db, codec=OrjsonTokenCodec())
+    token = await json_store.write_token(token_data)
+    token2 = await orjson_store.write_token(token_data)
+    await db.async_commit()
+    # 兼容旧的json数据
+    assert await orjson_store.read_token(token=token) == token_data
+    assert await json_store.read_token(token=token2) == token_data
+
+
+async def test_redis_token_store_codec(redis):
+    json_store = RedisTokenStore(redis)
+    msgpack_store = RedisTokenStore(redis, codec=MsgpackTokenCodec())
+    token = await json_store.write_token(token_data)
+    token2 = await msgpack_store.write_token(token_data)
+    assert await msgpack_store.read_token(token=token) == token_data
+    assert await msgpack_store.read_tokens([token, token2]) == [token_data, token_data]
+    assert len(await redis.get(msgpack_store.get_key(token2))) < len(await redis.get(json_store.get_key(token)))
+
+
+async def test_tiered_token_store(redis):
+    memory, durable = MemoryTokenStore(expire_seconds=60), RedisTokenStore(redis)
+    store = TieredTokenStore([memory, durable])
+    token = await store.write_token(token_data)
+    assert await memory.read_token(token) == token_data
+    assert await durable.read_token(token) == token_data
+    # promote
+    await memory.destroy_token(token)
+    assert await store.read_token(token) == token_data
+    assert await memory.read_token(token) == token_data
+    await store.destroy_token(token)
+    assert await store.read_token(token) is None
+    assert await durable.read_token(token) is None
+
+
+async def test_tiered_token_store_lower_tier_expires_first():
+    memory, durable = MemoryTokenStore(expire_seconds=60), MemoryTokenStore(expire_seconds=1)
+    store = TieredTokenStore([memory, durable])
+    token = await durable.write_token(token_data)
+    assert await store.read_token(token) == token_data
+    assert await memory.read_token(token) is None  # not promoted beyond its remaining ttl
+    await asyncio.sleep(1.1)
+    assert await store.read_token(token) is None
+    # promoted when the faster tier expires first
+    memory, durable = MemoryTokenStore(expire_seconds=1), MemoryTokenStore(expire_seconds=60)
+    store = TieredTokenStore([memory, durable])
+    token = await durable.write_token(token_data)
+    assert await store.read_token(token) == token_data
+    assert await memory.read_token(token) == token_data
+
+
+async def test_tiered_token_store_fallback(redis):
+    class BrokenStore(MemoryTokenStore):
+        calls = 0
+
+        async def read_token(self, token):
+            self.calls += 1
+            raise ConnectionError
+
+    broken, durable = BrokenStore(), RedisTokenStore(redis)
+    store = TieredTokenStore([broken, durable], retry_interval=60)
+    token = await durable.write_token(token_data)
+    assert await store.read_token(token) == token_data
+    assert await store.read_token(token) == token_data
+    assert broken.calls == 1  # skipped while down
+
+
+async def test_tiered_token_store_write_behind(redis):
+    memory, durable = MemoryTokenStore(), RedisTokenStore(redis)
+    store = TieredTokenStore([memory, durable], write_behind=True, queue_maxsize=1)
+    token1 = await store.write_token(token_data)
+    token2 = await store.write_token(token_data)  # queue full, write through
+    assert await durable.read_token(token2) == token_data
+    await store.destroy_token(token1)
+    await store.close()
+    assert await durable.read_token(token1) is None  # destroyed before written
+    token3 = await store.write_token(token_data)
+    await store.close()
+    assert await durable.read_token(token3) == token_data
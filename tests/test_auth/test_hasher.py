@@ -0,0 +1,57 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+from passlib.context import CryptContext
+
+from fastapi_user_auth.auth.exceptions import AuthError, ErrorCode
+from fastapi_user_auth.auth.hasher import PasswordHasher, calibrate_crypt_context
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=4)
+
+
+async def test_password_hasher():
+    hasher = PasswordHasher(pwd_context)
+    hashed = await hasher.hash("secret")
+    assert await hasher.verify("secret", hashed)
+    assert not await hasher.verify("wrong", hashed)
+    info = hasher.info()
+    assert info.calls == 3
+    assert info.pending == 0
+    assert info.hash_seconds > 0
+    hasher.shutdown()
+
+
+async def test_password_hasher_process_pool():
+    with ProcessPoolExecutor(1) as executor:
+        hasher = PasswordHasher(pwd_context, executor)
+        hashed = await hasher.hash("secret")
+        assert pwd_context.verify("secret", hashed)
+        assert await hasher.verify("secret", hashed)
+
+
+async def test_password_hasher_busy():
+    hasher = PasswordHasher(pwd_context, max_pending=1)
+    results = await asyncio.gather(hasher.hash("secret"), hasher.hash("secret"), return_exceptions=True)
+    assert isinstance(results[0], str)
+    assert isinstance(results[1], AuthError)
+    assert results[1].status == ErrorCode.SYSTEM_BUSY
+    assert hasher.info().rejected == 1
+    with pytest.raises(AuthError):
+        await asyncio.gather(hasher.verify("secret", results[0]), hasher.verify("secret", results[0]))
+    hasher.shutdown()
+
+
+async def test_calibrate_crypt_context():
+    context = calibrate_crypt_context(pwd_context, target_seconds=0.0001, min_rounds=4, max_rounds=6)
+    assert context.handler().default_rounds == 4
+    context = calibrate_crypt_context(pwd_context, target_seconds=10, min_rounds=4, max_rounds=6)
+    assert context.handler().default_rounds == 6
+    # rehash weaker hashes
+    hasher = PasswordHasher(context)
+    verified, new_hash = await hasher.verify_and_update("secret", pwd_context.hash("secret"))
+    assert verified
+    assert context.identify(new_hash) == "bcrypt"
+    assert context.verify("secret", new_hash)
+    assert await hasher.verify_and_update("secret", new_hash) == (True, None)
+    hasher.shutdown()
@@ -0,0 +1,43 @@
+from fastapi import FastAPI
+from fastapi_amis_admin.admin import Settings
+from sqlalchemy import func, select
+
+from fastapi_user_auth.admin import AuthAdminSite
+from fastapi_user_auth.auth import Auth
+from fastapi_user_auth.auth.history import LoginHistoryWriter
+from fastapi_user_auth.auth.models import LoginHistory
+
+
+async def count_history(db) -> int:
+    async with db():
+        return await db.async_scalar(select(func.count(LoginHistory.id)))
+
+
+async def test_login_history_writer(db):
+    writer = LoginHistoryWriter(db, batch_max_size=10, flush_interval=0.01)
+    for i in range(25):
+        await writer.write(LoginHistory(login_name=f"user{i}", login_status="Wrong password"))
+    await writer.close()
+    assert await count_history(db) == 25
+    assert writer.info().written == 25
+
+
+async def test_login_history_writer_drop(db):
+    writer = LoginHistoryWriter(db, queue_maxsize=2, flush_interval=0.01)
+    for i in range(5):
+        await writer.write(LoginHistory(login_name=f"user{i}"))
+    await writer.close()
+    assert writer.info().dropped == 3
+    assert await count_history(db) == 2
+
+
+async def test_login_history_writer_app_shutdown(db):
+    writer = LoginHistoryWriter(db, batch_max_size=100, flush_interval=1)
+    site = AuthAdminSite(settings=Settings(site_path="/admin"), engine=db, auth=Auth(db=db, login_history_writer=writer))
+    app = FastAPI()
+    site.mount_app(app)
+    await writer.write(LoginHistory(login_name="admin"))
+    assert await count_history(db) == 0
+    # 主应用关闭时写入队列中的记录
+    await app.router.shutdown()
+    assert await count_history(db) == 1
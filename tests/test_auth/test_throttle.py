@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from fakeredis import FakeAsyncRedis
+
+from fastapi_user_auth.auth.throttle import (
+    LoginThrottle,
+    MemoryThrottleBackend,
+    RedisThrottleBackend,
+)
+
+
+@pytest.fixture(params=["memory", "redis"])
+async def backend(request):
+    if request.param == "memory":
+        yield MemoryThrottleBackend(maxsize=100)
+        return
+    redis = FakeAsyncRedis()
+    yield RedisThrottleBackend(redis)
+    await redis.flushall()
+    await redis.aclose()
+
+
+async def test_login_throttle(backend):
+    throttle = LoginThrottle(backend, username_limit=3, ip_limit=5, window=60)
+    assert all([await throttle.allow("admin", "127.0.0.1") for _ in range(3)])
+    assert not await throttle.allow("admin", "127.0.0.1")
+    # ip limit
+    assert await throttle.allow("user1", "127.0.0.1")
+    assert await throttle.allow("user2", "127.0.0.1")
+    assert not await throttle.allow("user3", "127.0.0.1")
+    assert await throttle.allow("user3", "127.0.0.2")
+    # reset after successful login
+    await throttle.reset("admin")
+    assert await throttle.allow("admin", "127.0.0.2")
+
+
+async def test_login_throttle_window(backend):
+    throttle = LoginThrottle(backend, username_limit=1, ip_limit=0, window=0.01)
+    assert await throttle.allow("admin", "127.0.0.1")
+    assert not await throttle.allow("admin", "127.0.0.1")
+    await asyncio.sleep(0.02)
+    assert await throttle.allow("admin", "127.0.0.1")
+
+
+async def test_login_throttle_rejected_not_counted(backend):
+    throttle = LoginThrottle(backend, username_limit=2, ip_limit=2, window=60)
+    assert await throttle.allow("admin", "127.0.0.1")
+    assert await throttle.allow("user1", "127.0.0.1")
+    # ip限制拒绝的尝试不计入用户名的次数
+    assert not await throttle.allow("user2", "127.0.0.1")
+    assert not await throttle.allow("user2", "127.0.0.1")
+    assert await throttle.allow("user2", "127.0.0.2")
+    assert await throttle.allow("user2", "127.0.0.3")
+    # 用户名限制拒绝的尝试不计入ip的次数
+    assert not await throttle.allow("user2", "127.0.0.4")
+    assert await throttle.allow("user3", "127.0.0.4")
+    assert await throttle.allow("user4", "127.0.0.4")
+
+
+async def test_login_throttle_trusted_proxies(backend):
+    throttle = LoginThrottle(backend, username_limit=0, ip_limit=1, window=60, trusted_proxies=["10.0.0.0/8"])
+    assert throttle.get_client_ip("10.0.0.1", "1.1.1.1, 2.2.2.2, 10.0.0.2") == "2.2.2.2"
+    assert throttle.get_client_ip("10.0.0.1", "") == "10.0.0.1"
+    assert throttle.get_client_ip("3.3.3.3", "2.2.2.2") == "3.3.3.3"  # 不受信任的连接忽略代理头
+    # 代理后的客户端分别计数
+    assert await throttle.allow("admin", "10.0.0.1", "1.1.1.1")
+    assert await throttle.allow("admin", "10.0.0.1", "2.2.2.2")
+    assert not await throttle.allow("admin", "10.0.0.1", "1.1.1.1")
@@ -1,15 +1,23 @@
+import asyncio
+from datetime import datetime, timedelta
+from pathlib import Path
+
 import pytest
 from casbin import AsyncEnforcer
-from sqlalchemy import delete
+from sqlalchemy import delete, select
 
+import fastapi_user_auth.auth
 from fastapi_user_auth.admin import AuthAdminSite
 from fastapi_user_auth.admin.utils import update_casbin_site_grouping
-from fastapi_user_auth.auth.models import CasbinRule
+from fastapi_user_auth.auth.models import CasbinRule, CasbinRuleChange
 from fastapi_user_auth.utils.casbin import (
     get_subject_page_permissions,
     update_subject_page_permissions,
     update_subject_roles,
 )
+from fastapi_user_auth.utils.enforcer import AsyncCachedEnforcer
+from fastapi_user_auth.utils.sqlachemy_adapter import Adapter
+from fastapi_user_auth.utils.watcher import PolicyWatcher
 
 
 @pytest.fixture
@@ -99,3 +107,253 @@ async def test_casbin_update_subject_page_permissions(enforcer: AsyncEnforcer, a
     # 非page权限应该保留
     assert enforcer.has_policy("r:admin", user_admin_unique_id, "page:list:email", "page:list", "allow")
     assert enforcer.has_policy("r:admin", user_admin_unique_id, "page:filter:email", "page:filter", "allow")
+
+
+async def test_cached_enforcer(enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
+    enforcer.index_policies = False  # 只测试缓存
+    casbin_rule_admin_unique_id = admin_instances["casbin_rule_admin"].unique_id
+    assert not enforcer.enforce("u:admin", casbin_rule_admin_unique_id, "page", "page")
+    assert enforcer.enforce_cache.info().currsize == 1
+    version = enforcer.policy_version
+    # 权限变更后缓存失效
+    await update_subject_page_permissions(enforcer, subject="r:admin", permissions=[f"{casbin_rule_admin_unique_id}#page#page"])
+    assert enforcer.policy_version > version
+    assert enforcer.enforce("u:admin", casbin_rule_admin_unique_id, "page", "page")
+    # 角色变更后缓存失效
+    await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:test"])
+    assert not enforcer.enforce("u:admin", casbin_rule_admin_unique_id, "page", "page")
+    assert enforcer.enforce("u:admin", casbin_rule_admin_unique_id, "page", "page") is False
+    assert enforcer.enforce_cache.info().hits >= 1
+
+
+async def test_permission_index(db, enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
+    user_admin_unique_id = admin_instances["user_admin"].unique_id
+    db.add_all(
+        [
+            CasbinRule(ptype="g", v0="u:test", v1="r:admin"),
+            # 用户的策略优先于角色的策略
+            CasbinRule(ptype="p", v0="u:test", v1=user_admin_unique_id, v2="page:delete", v3="page", v4="deny"),
+            CasbinRule(ptype="p", v0="u:vip", v1=user_admin_unique_id, v2="page:*", v3="page", v4="allow"),
+        ]
+    )
+    await db.async_commit()
+    await enforcer.load_policy()
+    reference = AsyncEnforcer(enforcer.get_model(), enforcer.get_adapter())
+    await reference.load_policy()
+    objs = [admin.unique_id for admin in admin_instances.values()]
+    acts = ["page", "page:list", "page:delete", "page:list:email", "page:update:email"]
+    for sub in ["u:admin", "u:test", "u:vip", "u:root", "r:admin", "u:guest"]:
+        for obj in objs:
+            for act in acts:
+                for group in ["page", "page:list", "page:update"]:
+                    request = (sub, obj, act, group)
+                    assert enforcer.enforce(*request) == reference.enforce(*request), request
+    assert enforcer.permission_index.subjects["u:test"] is not None
+    assert enforcer.permission_index.subjects["u:vip"] is None  # keyMatch通配符
+    assert enforcer.permission_index.subjects["u:root"] is None
+    # 权限变更后重新编译
+    await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:test"])
+    assert enforcer.permission_index is None
+    assert not enforcer.enforce("u:admin", user_admin_unique_id, "page", "page")
+
+
+async def test_load_policy_changes(db, enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
+    # 另一个进程中的enforcer
+    peer = AsyncCachedEnforcer(
+        str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"),
+        Adapter(db, db_class=CasbinRule, change_class=CasbinRuleChange),
+    )
+    await peer.load_policy()
+    assert await peer.load_policy_changes() == 0
+    casbin_rule_admin_unique_id = admin_instances["casbin_rule_admin"].unique_id
+    await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:test"])
+    await update_subject_page_permissions(enforcer, subject="r:test", permissions=[f"{casbin_rule_admin_unique_id}#page#page"])
+    assert not peer.enforce("u:admin", casbin_rule_admin_unique_id, "page", "page")
+    assert await peer.load_policy_changes() > 0
+    assert peer.enforce("u:admin", casbin_rule_admin_unique_id, "page", "page")
+    assert sorted(map(list, peer.get_policy())) == sorted(map(list, enforcer.get_policy()))
+    assert sorted(map(list, peer.get_grouping_policy())) == sorted(map(list, enforcer.get_grouping_policy()))
+    assert peer.policy_revision == await enforcer.adapter.get_policy_revision()
+    # 全量保存后重新加载全部规则
+    await enforcer.save_policy()
+    assert await peer.load_policy_changes() == 1
+    assert sorted(map(list, peer.get_policy())) == sorted(map(list, enforcer.get_policy()))
+
+
+async def test_load_policy_changes_order(db, enforcer: AsyncEnforcer, fake_data):
+    peer = AsyncCachedEnforcer(
+        str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"),
+        Adapter(db, db_class=CasbinRule, change_class=CasbinRuleChange),
+    )
+    await peer.load_policy()
+    await enforcer.add_grouping_policy("u:alice", "r:staff")
+    await enforcer.add_policy("r:staff", "X", "page", "page", "allow")
+    await peer.load_policy_changes()
+    assert peer.enforce("u:alice", "X", "page", "page")
+    # 用户的拒绝规则优先于角色的允许规则
+    await enforcer.add_policy("u:alice", "X", "page", "page", "deny")
+    await peer.load_policy_changes()
+    full = AsyncCachedEnforcer(
+        str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"),
+        Adapter(db, db_class=CasbinRule, change_class=CasbinRuleChange),
+    )
+    await full.load_policy()
+    assert not full.enforce("u:alice", "X", "page", "page")
+    assert not peer.enforce("u:alice", "X", "page", "page")
+
+
+async def test_load_policy_changes_gaps(db, enforcer: AsyncEnforcer, fake_data):
+    peer = AsyncCachedEnforcer(
+        str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"),
+        Adapter(db, db_class=CasbinRule, change_class=CasbinRuleChange),
+    )
+    await peer.load_policy()
+    revision = peer.policy_revision
+    # 较早分配的id在之后才提交
+    db.add(CasbinRuleChange(id=revision + 2, op="add", ptype="g", v0="u:late", v1="r:b"))
+    await db.async_commit()
+    assert await peer.load_policy_changes() == 1
+    assert peer.policy_revision == revision + 2
+    assert list(peer.policy_gaps) == [revision + 1]
+    db.add(CasbinRuleChange(id=revision + 1, op="add", ptype="g", v0="u:late", v1="r:a"))
+    await db.async_commit()
+    assert await peer.load_policy_changes() == 1
+    assert peer.has_grouping_policy("u:late", "r:a")
+    assert not peer.policy_gaps
+    assert peer.policy_revision == revision + 2
+    # 超时后不再等待
+    peer.policy_gap_timeout = 0
+    db.add(CasbinRuleChange(id=revision + 4, op="add", ptype="g", v0="u:late", v1="r:c"))
+    await db.async_commit()
+    assert await peer.load_policy_changes() == 1
+    assert not peer.policy_gaps
+    # 生成器参数的规则同样记录在变更记录中
+    await enforcer.adapter.add_policies("g", "g", (rule for rule in [["u:gen", "r:a"]]))
+    assert await peer.load_policy_changes() == 1
+    assert peer.has_grouping_policy("u:gen", "r:a")
+    # 超过保留期限的变更记录在修改时删除
+    db.add(CasbinRuleChange(op="add", ptype="g", v0="u:old", v1="r:a", create_time=datetime.now() - timedelta(days=8)))
+    await db.async_commit()
+    await enforcer.adapter.add_policy("g", "g", ["u:new", "r:a"])
+    assert not await db.async_scalar(select(CasbinRuleChange).where(CasbinRuleChange.v0 == "u:old"))
+    assert await peer.load_policy_changes() == 1
+    # 超过保留期限未加载时重新加载全部规则
+    peer._policy_loaded_at -= enforcer.adapter.change_retention + 1
+    assert await peer.load_policy_changes() == 0
+    assert peer.policy_revision == await enforcer.adapter.get_policy_revision()
+
+
+async def test_lazy_subjects(db, enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
+    user_admin_unique_id = admin_instances["user_admin"].unique_id
+    db.add_all(
+        [
+            CasbinRule(ptype="g", v0="u:test", v1="r:admin"),
+            CasbinRule(ptype="p", v0="u:test", v1=user_admin_unique_id, v2="page:delete", v3="page", v4="deny"),
+        ]
+    )
+    await db.async_commit()
+    await enforcer.load_policy()
+    lazy = AsyncCachedEnforcer(
+        str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"),
+        Adapter(db, db_class=CasbinRule, change_class=CasbinRuleChange),
+        lazy_subjects=2,
+    )
+    await lazy.load_policy()
+    assert not lazy.get_policy()  # 只加载分组规则
+    assert sorted(map(list, lazy.get_grouping_policy())) == sorted(map(list, enforcer.get_grouping_policy()))
+    with pytest.raises(RuntimeError):
+        lazy.enforce("u:test", user_admin_unique_id, "page", "page")
+    objs = [admin.unique_id for admin in admin_instances.values()]
+    acts = ["page", "page:list", "page:delete", "page:list:email"]
+    for sub in ["u:admin", "u:test", "u:root", "r:admin", "u:guest"]:
+        await lazy.load_subjects(sub)
+        for obj in objs:
+            for act in acts:
+                request = (sub, obj, act, "page")
+                assert lazy.enforce(*request) == enforcer.enforce(*request), request
+    # 只保留最近使用的主体的规则
+    assert list(lazy.loaded_subjects) == ["r:admin", "u:guest"]
+    assert {rule[0] for rule in lazy.get_policy()} <= {"r:admin", "u:guest"}
+    assert len(lazy.get_policy()) == len(enforcer.get_filtered_policy(0, "r:admin")) + len(
+        enforcer.get_filtered_policy(0, "u:guest")
+    )
+    # 角色变更后重新加载主体的规则
+    casbin_rule_admin_unique_id = admin_instances["casbin_rule_admin"].unique_id
+    await lazy.load_subjects("u:guest")
+    await update_subject_roles(enforcer, subject="u:guest", role_keys=["r:test"])
+    await update_subject_page_permissions(enforcer, subject="r:test", permissions=[f"{casbin_rule_admin_unique_id}#page#page"])
+    await lazy.load_policy_changes()
+    await lazy.load_subjects("u:guest")
+    assert lazy.enforce("u:guest", casbin_rule_admin_unique_id, "page", "page")
+    assert "r:test" in lazy.loaded_subjects["u:guest"][1]
+
+
+async def test_lazy_subjects_not_loaded(db, enforcer: AsyncEnforcer, admin_instances: dict, fake_data):
+    user_admin_unique_id = admin_instances["user_admin"].unique_id
+    lazy = AsyncCachedEnforcer(
+        str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"),
+        Adapter(db, db_class=CasbinRule, change_class=CasbinRuleChange),
+        lazy_subjects=1,
+    )
+    await lazy.load_policy()
+    request = ("u:admin", user_admin_unique_id, "page", "page")
+    with pytest.raises(RuntimeError, match="u:admin"):
+        lazy.enforce(*request)
+    assert lazy.enforce("u:root", user_admin_unique_id, "page", "page")  # root无需加载
+    await lazy.load_subjects("u:admin")
+    assert lazy.enforce(*request) == enforcer.enforce(*request)
+    # 被移除的主体需要重新加载
+    await lazy.load_subjects("u:guest")
+    with pytest.raises(RuntimeError, match="u:admin"):
+        lazy.enforce(*request)
+
+
+@pytest.mark.parametrize("use_redis", [True, False])
+async def test_policy_watcher(db, enforcer: AsyncEnforcer, admin_instances: dict, fake_data, use_redis):
+    from fakeredis import FakeAsyncRedis
+
+    redis = FakeAsyncRedis() if use_redis else None
+    peer = AsyncCachedEnforcer(
+        str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"),
+        Adapter(db, db_class=CasbinRule, change_class=CasbinRuleChange),
+    )
+    await peer.load_policy()
+    watchers = [PolicyWatcher(e, redis=redis, poll_interval=0.05, debounce=0.05) for e in (enforcer, peer)]
+    for watcher in watchers:
+        await watcher.start()
+    await asyncio.sleep(0.05)  # 等待订阅
+    try:
+        casbin_rule_admin_unique_id = admin_instances["casbin_rule_admin"].unique_id
+        # 批量修改只触发一次重新加载
+        await update_subject_roles(enforcer, subject="u:admin", role_keys=["r:test"])
+        await update_subject_page_permissions(
+            enforcer, subject="r:test", permissions=[f"{casbin_rule_admin_unique_id}#page#page"]
+        )
+        for _ in range(100):
+            if watchers[1].reloads:
+                break
+            await asyncio.sleep(0.02)
+        assert watchers[1].reloads == 1
+        assert peer.enforce("u:admin", casbin_rule_admin_unique_id, "page", "page")
+    finally:
+        for watcher in watchers:
+            await watcher.close()
+        if redis is not None:
+            await redis.aclose()
+
+
+async def test_policy_watcher_file_adapter(tmp_path):
+    from casbin.persist.adapters.asyncio import AsyncFileAdapter
+    from fakeredis import FakeAsyncRedis
+
+    policy = tmp_path / "policy.csv"
+    policy.write_text("p, u:test, page, page, page, allow\n")
+    redis = FakeAsyncRedis()
+    enforcer = AsyncEnforcer(str(Path(fastapi_user_auth.auth.__file__).parent / "model.conf"), AsyncFileAdapter(str(policy)))
+    watcher = PolicyWatcher(enforcer, redis=redis)
+    try:
+        await watcher.reload()  # 适配器没有数据库会话
+        assert watcher.reloads == 1
+        assert enforcer.enforce("u:test", "page", "page", "page")
+    finally:
+        await redis.aclose()